@@ -3,9 +3,11 @@
 from .azure_manager_class import AzureManager
 from .azure_storage_client import AzureStorageClient
 from .azure_storage_processor import AzureBlobStorageProcessor
+from .azure_download_blobs import DownloadError
 
 __all__ = [
     "AzureManager",
     "AzureStorageClient", 
     "AzureBlobStorageProcessor",
+    "DownloadError",
 ]
@@ -1,47 +1,246 @@
+import asyncio
+import contextlib
+import email.utils
+import functools
+import importlib.util
 import traceback
-from typing import List, Dict, Tuple, Optional
+from collections import deque
+from collections.abc import Sized
+from datetime import datetime, timezone
+from typing import AsyncIterator, Iterable, Iterator, List, Dict, Tuple, Optional
 import requests
 import os
 import logging
+import random
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from azure.core.pipeline.transport import RequestsTransport
+from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient, ExponentialRetry
 import hashlib
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
+from ..settings import AZURE_MAX_PARALLEL_DOWNLOADS
 
 logger = logging.getLogger(__name__)
 
-def setup_requests_session() -> requests.Session:
-    """Sets up a requests session with a retry mechanism.
+HASH_BUFFER_SIZE = 1 << 20
+WRITE_BUFFER_SIZE = 1 << 20
+MAX_AUTO_WORKERS = 64
+MAX_RETRY_DELAY = 60
+MAX_HASH_WORKERS = 8
+# Uploads above UPLOAD_SINGLE_PUT_SIZE are split in blocks of UPLOAD_BLOCK_SIZE, which can be sent in parallel
+# (the SDK defaults to a single PUT up to 64 MiB)
+UPLOAD_SINGLE_PUT_SIZE = 4 * 1024 * 1024
+UPLOAD_BLOCK_SIZE = 8 * 1024 * 1024
+
+# Maximum number of blobs per listing page allowed by the service, to limit listing round trips
+LISTING_PAGE_SIZE = 5000
+
+# Default number of parallel connections of a single download (only used for blobs larger than the SDK chunk get size)
+DEFAULT_DOWNLOAD_CONCURRENCY = 4
+# Connections of the shared pool left for uploads and the other requests (listings, properties, deletions)
+SHARED_POOL_EXTRA_CONNECTIONS = 32
+# Every download slot may use DEFAULT_DOWNLOAD_CONCURRENCY connections at once: a smaller pool would make the downloads
+# open and discard extra connections. It grows with AZURE_MAX_PARALLEL_DOWNLOADS
+SHARED_POOL_SIZE = AZURE_MAX_PARALLEL_DOWNLOADS * DEFAULT_DOWNLOAD_CONCURRENCY + SHARED_POOL_EXTRA_CONNECTIONS
+
+class DownloadSlots:
+    """Bounded semaphore that can be acquired from threads and from event loops.
+
+    Async waiters wait on a future resolved by release(), instead of blocking their event loop or polling.
+    """
+
+    def __init__(self, value: int):
+        self._initial_value = value
+        self._value = value
+        self._condition = threading.Condition()
+        # (event loop, future) of the coroutines waiting for a slot, in arrival order
+        self._async_waiters = deque()
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """Acquires a slot from a thread.
+
+        Args:
+            blocking (bool, optional): Whether to wait for a slot to be released. Defaults to True.
+
+        Returns:
+            bool: True if a slot was acquired, False otherwise (only when not blocking).
+        """
+        with self._condition:
+            while self._value == 0:
+                if not blocking:
+                    return False
+                self._condition.wait()
+            self._value -= 1
+            return True
+
+    async def acquire_async(self) -> None:
+        """Acquires a slot from a coroutine, without blocking its event loop."""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                if self._value > 0:
+                    self._value -= 1
+                    return
+                future = loop.create_future()
+                self._async_waiters.append((loop, future))
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # Woken up but cancelled before taking the slot: pass the wake-up on
+                    with self._condition:
+                        self._wake_async_waiter()
+                raise
+
+    def release(self) -> None:
+        """Releases a slot, waking up one waiting thread and one waiting coroutine (the first one to take it wins)."""
+        with self._condition:
+            if self._value >= self._initial_value:
+                raise ValueError("DownloadSlots released too many times")
+            self._value += 1
+            self._condition.notify()
+            self._wake_async_waiter()
+
+    def _wake_async_waiter(self) -> None:
+        # Must be called with the condition held
+        while self._async_waiters:
+            loop, future = self._async_waiters.popleft()
+            try:
+                loop.call_soon_threadsafe(self._resolve_async_waiter, future)
+                return
+            except RuntimeError:
+                # The event loop of this waiter is closed
+                continue
+
+    def _resolve_async_waiter(self, future: asyncio.Future) -> None:
+        if future.done():
+            # The waiting coroutine was cancelled: wake up the next one instead
+            with self._condition:
+                self._wake_async_waiter()
+        else:
+            future.set_result(None)
+
+    def __enter__(self) -> "DownloadSlots":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+# Caps the blobs downloaded at the same time in the whole process, whatever the number of concurrent threaded or async downloads
+download_slots = DownloadSlots(AZURE_MAX_PARALLEL_DOWNLOADS)
+
+class JitteredRetry(ExponentialRetry):
+    """SDK retry policy applying full jitter to the exponential backoff, capped at MAX_RETRY_DELAY.
+
+    Parallel downloads throttled at the same time would otherwise all retry at about the same offsets
+    (the default policy only varies them by a few seconds). A Retry-After header sent with a retried
+    response (the service throttles with 503 Server Busy) takes precedence over the backoff.
+    """
+
+    def __init__(self, retry_total: int = 8, **kwargs):
+        super().__init__(retry_total=retry_total, **kwargs)
+
+    def get_backoff_time(self, settings: Dict) -> float:
+        history = settings['history']
+        response = history[-1].http_response if history else None
+        retry_after = _get_retry_after(response.headers.get("Retry-After")) if response is not None else None
+        if retry_after is not None:
+            return min(MAX_RETRY_DELAY, retry_after)
+        backoff = self.initial_backoff + (0 if settings['count'] == 0 else self.increment_base ** settings['count'])
+        return random.uniform(0, min(MAX_RETRY_DELAY, backoff))
+
+def _get_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parses a Retry-After header, given in seconds or as an HTTP date. Returns None if it is missing or invalid."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (email.utils.parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+class DownloadError(Exception):
+    """Raised when some blobs of a batch could not be downloaded."""
+
+    def __init__(self, failed_downloads: List[Tuple[str, Exception]], downloaded_paths: List[str]):
+        """Initializes the DownloadError.
+
+        Args:
+            failed_downloads (List[Tuple[str, Exception]]): The blob names that failed, with their error.
+            downloaded_paths (List[str]): The local paths of the blobs that were successfully downloaded.
+        """
+        self.failed_downloads = failed_downloads
+        self.downloaded_paths = downloaded_paths
+        blob_name, error = failed_downloads[0]
+        super().__init__(f"Failed to download {len(failed_downloads)} blob(s), first failure on {blob_name}: {error}")
+
+def setup_sdk_session(pool_size: int = 10) -> requests.Session:
+    """Sets up a pooled requests session for the Azure SDK clients, without any urllib3 retries.
+
+    The SDK has its own retry policy (JitteredRetry): retrying again in urllib3 would multiply the attempts on every failure.
+    The transport does not own the session, so azure-core does not disable them itself.
+
+    Args:
+        pool_size (int, optional): The number of pooled connections to keep per host. Defaults to 10.
 
     Returns:
         requests.Session: The configured requests session.
     """
     session = requests.Session()
-    retries = Retry(
-        total=5,
-        backoff_factor=1,
-        status_forcelist=[500, 502, 503, 504, 429],
-        allowed_methods=["GET"]
-    )
-    adapter = HTTPAdapter(max_retries=retries, pool_connections=10, pool_maxsize=10)
+    adapter = HTTPAdapter(max_retries=Retry(total=False, raise_on_status=False), pool_connections=pool_size, pool_maxsize=pool_size)
     session.mount('http://', adapter)
     session.mount('https://', adapter)
     return session
 
-def verify_file_size(path: str, expected_size: int) -> bool:
-    """Verifies the size of a file.
+@functools.lru_cache(maxsize=1)
+def get_shared_transport() -> RequestsTransport:
+    """Returns the process-wide transport shared by all cached container clients.
+
+    The transport does not own its session, so closing a client never closes the shared connection pool.
+
+    Returns:
+        RequestsTransport: The shared transport.
+    """
+    session = setup_sdk_session(pool_size=SHARED_POOL_SIZE)
+    return RequestsTransport(session=session, session_owner=False)
+
+@functools.lru_cache(maxsize=32)
+def get_cached_container_client(sas_url: str) -> ContainerClient:
+    """Returns a ContainerClient for a SAS URL, reusing the same instance (and its warm connections) across calls.
 
     Args:
-        path (str): The path to the file.
-        expected_size (int): The expected size of the file in bytes.
+        sas_url (str): The SAS URL for the container.
 
     Returns:
-        bool: True if the file size matches the expected size, False otherwise.
+        ContainerClient: The cached ContainerClient.
     """
-    actual_size = os.path.getsize(path)
-    return actual_size == expected_size
+    return ContainerClient.from_container_url(container_url=sas_url, transport=get_shared_transport(), retry_policy=JitteredRetry(),
+                                              max_single_put_size=UPLOAD_SINGLE_PUT_SIZE, max_block_size=UPLOAD_BLOCK_SIZE)
+
+def preallocate_file(fd: int, size: int) -> None:
+    """Reserves disk space for a file about to be written, when the platform supports it (Linux).
+
+    The file system can then allocate contiguous extents once instead of growing the file on every write.
+    Small files are skipped, as they are written in a single buffered write anyway.
+
+    Args:
+        fd (int): The file descriptor of the file.
+        size (int): The final size of the file in bytes.
+    """
+    if size < WRITE_BUFFER_SIZE or not hasattr(os, "posix_fallocate"):
+        return
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except OSError as e:
+        # e.g. file systems that do not support fallocate
+        logger.debug(f"Could not preallocate {size} bytes: {e}")
 
 def calculate_file_hash(path: str) -> str:
     """Calculates the SHA256 hash of a file.
@@ -52,38 +251,155 @@ def calculate_file_hash(path: str) -> str:
     Returns:
         str: The SHA256 hash of the file.
     """
-    sha256_hash = hashlib.sha256()
     with open(path, "rb") as f:
-        for byte_block in iter(lambda: f.read(4096), b""):
-            sha256_hash.update(byte_block)
+        if hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(f, "sha256").hexdigest()
+        # Python < 3.11: reuse a single 1 MiB buffer instead of allocating per chunk
+        sha256_hash = hashlib.sha256()
+        buffer = memoryview(bytearray(HASH_BUFFER_SIZE))
+        while n := f.readinto(buffer):
+            sha256_hash.update(buffer[:n])
     return sha256_hash.hexdigest()
 
-def download_blob(blob_client: BlobClient, local_file_path: str, max_concurrency: int = 4, max_retries: int = 3) -> bool:
+def get_effective_workers(max_workers: Optional[int], nb_blobs: Optional[int]) -> int:
+    """Computes the number of download threads to use.
+
+    Small blobs are dominated by request latency, so the automatic mode scales the number of threads with the workload.
+
+    Args:
+        max_workers (Optional[int]): The requested number of threads, or None for automatic sizing.
+        nb_blobs (Optional[int]): The number of blobs to download, or None if unknown (streamed blob names).
+
+    Returns:
+        int: The number of threads, never more than the number of blobs and at least 1.
+    """
+    if nb_blobs is None:
+        return max(1, max_workers or MAX_AUTO_WORKERS)
+    if max_workers is None:
+        max_workers = min(MAX_AUTO_WORKERS, 4 + nb_blobs // 8)
+    return max(1, min(max_workers, nb_blobs))
+
+def get_local_blob_path(blob_name: str, download_directory: str, prefix_to_remove: str = "") -> str:
+    """Computes the local path of a blob, mirroring its name under the download directory.
+
+    Args:
+        blob_name (str): The name of the blob in Azure Storage.
+        download_directory (str): The root directory to save the blob.
+        prefix_to_remove (str, optional): The prefix to remove from the blob name. Defaults to "".
+
+    Returns:
+        str: The local path of the blob.
+    """
+    # Remove the "prefix." and split the remaining path into directories
+    if prefix_to_remove and blob_name.startswith(prefix_to_remove):
+        local_blob_path = blob_name[len(prefix_to_remove):]
+    else:
+        local_blob_path = blob_name
+
+    # Construct the full local path
+    blob_dir_path, file_name = os.path.split(local_blob_path)
+    return os.path.join(download_directory, blob_dir_path, file_name)
+
+def hash_files_parallel(paths: List[str]) -> Dict[str, str]:
+    """Calculates the SHA256 hashes of several files in parallel.
+
+    hashlib releases the GIL while hashing, so the files are hashed truly in parallel.
+    Transfers themselves are already checked by the Azure SDK: this is only needed for integrity audits of local files.
+
+    Args:
+        paths (List[str]): The paths to the files.
+
+    Returns:
+        Dict[str, str]: The SHA256 hash of each file, by path.
+    """
+    if not paths:
+        return {}
+    max_workers = min(MAX_HASH_WORKERS, os.cpu_count() or 1, len(paths))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(paths, executor.map(calculate_file_hash, paths)))
+
+def is_local_copy_up_to_date(blob_client: BlobClient, local_file_path: str) -> bool:
+    """Checks with a single HEAD request whether a previously downloaded file still matches its blob.
+
+    download_blob stamps downloaded files with the blob last modified time, so a file matches when both
+    its size and its modification time are the ones of the blob.
+
+    Args:
+        blob_client (BlobClient): The BlobClient for the blob.
+        local_file_path (str): The local path of the downloaded blob.
+
+    Returns:
+        bool: True if the local file is up to date, False otherwise.
+    """
+    if not os.path.exists(local_file_path):
+        return False
+    try:
+        properties = blob_client.get_blob_properties()
+    except Exception as e:
+        logger.debug(f"Could not get properties of {blob_client.blob_name}: {e}")
+        return False
+    return is_local_file_up_to_date(local_file_path, properties.size, properties.last_modified)
+
+def is_local_file_up_to_date(local_file_path: str, size: Optional[int], last_modified: Optional[datetime]) -> bool:
+    """Checks whether a previously downloaded file matches the given blob size and last modified time, without any request.
+
+    Args:
+        local_file_path (str): The local path of the downloaded blob.
+        size (Optional[int]): The size of the blob in bytes.
+        last_modified (Optional[datetime]): The last modified time of the blob.
+
+    Returns:
+        bool: True if the local file is up to date, False otherwise (or if the blob properties are unknown).
+    """
+    if size is None or last_modified is None:
+        return False
+    try:
+        stat = os.stat(local_file_path)
+    except OSError:
+        return False
+    return stat.st_size == size and int(stat.st_mtime) == int(last_modified.timestamp())
+
+def download_blob(blob_client: BlobClient, local_file_path: str, max_concurrency: int = DEFAULT_DOWNLOAD_CONCURRENCY, max_retries: int = 3, skip_existing: bool = True) -> bool:
     """Downloads a single blob with retries and verification.
 
+    Each attempt holds one of the process-wide download slots (download_slots) during its transfer.
+
     Args:
         blob_client (BlobClient): The BlobClient for the blob to download.
         local_file_path (str): The local path to save the blob to.
-        max_concurrency (int, optional): The maximum number of parallel connections to use. Defaults to 4.
+        max_concurrency (int, optional): The maximum number of parallel connections to use. As the content is validated, the SDK
+            downloads blobs in 4 MiB range requests (its chunk get size), and writes each range at its offset in the file. Defaults to DEFAULT_DOWNLOAD_CONCURRENCY.
         max_retries (int, optional): The maximum number of retries. Defaults to 3.
+        skip_existing (bool, optional): Whether to skip the download when the local file was already downloaded from the
+            same version of the blob. Defaults to True.
 
     Returns:
         bool: True if the download is successful, False otherwise.
     """
+    if skip_existing and is_local_copy_up_to_date(blob_client, local_file_path):
+        return True
     temp_path = local_file_path + '.temp'
     for attempt in range(max_retries):
+        if attempt > 0:
+            # Exponential backoff with jitter so that throttled workers do not retry in lockstep
+            time.sleep(min(MAX_RETRY_DELAY, 2 ** (attempt - 1) + random.random()))
         try:
-            # Attempt to download blob stream directly
-            download_stream = blob_client.download_blob(max_concurrency=max_concurrency)
-            expected_size = download_stream.properties.size  # Blob size from download stream
+            # The process-wide slot is only held during the transfer, not during the existence check nor the backoff
+            with download_slots:
+                # Attempt to download blob stream directly, the SDK checks the MD5 of each downloaded range.
+                # The service only returns range MD5s up to 4 MiB, so the chunk get size must keep its default
+                download_stream = blob_client.download_blob(max_concurrency=max_concurrency, validate_content=True)
+                expected_size = download_stream.properties.size  # Blob size from download stream
 
-            # Download in chunks
-            with open(temp_path, "wb") as file:
-                for chunk in download_stream.chunks():
-                    file.write(chunk)
+                # Let the SDK stream directly into the file
+                with open(temp_path, "wb", buffering=WRITE_BUFFER_SIZE) as file:
+                    preallocate_file(file.fileno(), expected_size)
+                    written_size = download_stream.readinto(file)
 
-            # Verify file size
-            if verify_file_size(temp_path, expected_size):
+            # Verify file size (the file size on disk is the preallocated one, so check the streamed bytes)
+            if written_size == expected_size:
+                last_modified = download_stream.properties.last_modified.timestamp()
+                os.utime(temp_path, (last_modified, last_modified))
                 os.replace(temp_path, local_file_path)
                 #logger.debug(f"Successfully downloaded and verified: {local_file_path}")
                 return True
@@ -99,26 +415,37 @@ def download_blob(blob_client: BlobClient, local_file_path: str, max_concurrency
                 raise Exception(f"Failed to download {blob_client.blob_name} to {local_file_path} after {max_retries} attempts. {e}")
     return False
 
-def download_blobs_in_parallel(sas_url: str,  blob_names: List[str],
-                               download_directory: str, max_workers: int = 4, max_concurrency: int = 4, prefix_to_remove:str="") ->List[str]:
+def download_blobs_in_parallel(sas_url: str,  blob_names: Iterable[str],
+                               download_directory: str, max_workers: Optional[int] = None, max_concurrency: int = DEFAULT_DOWNLOAD_CONCURRENCY, prefix_to_remove:str="",
+                               fail_fast: bool = False) ->List[str]:
     """Downloads multiple blobs in parallel.
 
     Args:
         sas_url (str): The SAS URL for the container.
-        blob_names (List[str]): The list of blob names to download.
+        blob_names (Iterable[str]): The blob names to download. Can be a lazy iterator (e.g. from iter_blob_names_with_prefix):
+            downloads then start while the names are still being listed.
         download_directory (str): The directory to download the blobs to.
-        max_workers (int, optional): The maximum number of worker threads. Defaults to 4.
-        max_concurrency (int, optional): The maximum number of parallel connections for each download. Defaults to 4.
+        max_workers (int, optional): The maximum number of worker threads. Defaults to None, which scales it with the number of blobs.
+        max_concurrency (int, optional): The maximum number of parallel connections for each download. Only used for blobs larger
+            than the SDK chunk get size (4 MiB). Defaults to DEFAULT_DOWNLOAD_CONCURRENCY.
         prefix_to_remove (str, optional): The prefix to remove from the blob name when creating the local file path. Defaults to "".
+        fail_fast (bool, optional): Whether to stop downloading after the first failure. Otherwise all the other blobs are
+            still downloaded before raising. Defaults to False.
+
+    Raises:
+        DownloadError: if some blobs could not be downloaded. It holds the failures and the paths that were downloaded.
 
     Returns:
         ->List[str]: list of pths of the downloaded blobs.
     """
-    logger.debug(f"download_blobs_in_parallel with prefix, nb files= {len(blob_names)} prefix {prefix_to_remove}")
-    # Initialize ContainerClient with the account URL
-    container_client = ContainerClient.from_container_url(container_url=sas_url)
+    nb_blobs = len(blob_names) if isinstance(blob_names, Sized) else None
+    logger.debug(f"download_blobs_in_parallel with prefix, nb files= {nb_blobs} prefix {prefix_to_remove}")
+    container_client = get_cached_container_client(sas_url)
+    max_workers = get_effective_workers(max_workers, nb_blobs)
 
     os.makedirs(download_directory, exist_ok=True)
+    # Many blobs share a few directories: only create each of them once
+    created_dirs = {download_directory}
 
     def download_single_blob(blob_name: str, download_directory: str) ->str:
         """Downloads a single blob and saves it to a directory structure derived from its name.
@@ -127,40 +454,324 @@ def download_blobs_in_parallel(sas_url: str,  blob_names: List[str],
             blob_name (str): The name of the blob in Azure Storage.
             download_directory (str): The root directory to save the blob.
         """
-        # Remove the "prefix." and split the remaining path into directories
-        if prefix_to_remove !="" and prefix_to_remove in blob_name:
-            local_blob_path = blob_name[len(prefix_to_remove):]
-        else:
-            local_blob_path = blob_name
-
-        # Construct the full local path
-        blob_dir_path, file_name = os.path.split(local_blob_path)
-        local_path = os.path.join(download_directory, blob_dir_path, file_name)
+        local_path = get_local_blob_path(blob_name, download_directory, prefix_to_remove)
 
         # Ensure directories exist
-        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        local_dir = os.path.dirname(local_path)
+        if local_dir not in created_dirs:
+            os.makedirs(local_dir, exist_ok=True)
+            created_dirs.add(local_dir)
 
-        # Download the blob
+        # Download the blob. get_blob_client shares the container pipeline and transport, which is cheaper
+        # than building a BlobClient from a blob URL (a new pipeline per blob)
         blob_client = container_client.get_blob_client(blob_name)
         download_blob(blob_client, local_path, max_concurrency)
         return local_path
 
     output_paths = []
     failed_downloads = []
-    error =""
+    blob_names_iterator = iter(blob_names)
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(download_single_blob, blob_name, download_directory): blob_name for blob_name in blob_names}
-        for future in as_completed(futures):
-            blob_name = futures[future]
+        # Keep at most 2 * max_workers downloads in flight: memory no longer grows with the number of blobs
+        futures = {executor.submit(download_single_blob, blob_name, download_directory): blob_name
+                   for blob_name in islice(blob_names_iterator, 2 * max_workers)}
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                blob_name = futures.pop(future)
+                try:
+                    local_path = future.result()
+                    output_paths.append(local_path)
+                except Exception as e:
+                    failed_downloads.append((blob_name, e))
+                    if fail_fast:
+                        # Stop submitting and drop the downloads that have not started yet
+                        blob_names_iterator = iter(())
+                        for pending_future in [f for f in futures if f.cancel()]:
+                            futures.pop(pending_future)
+                for next_blob_name in islice(blob_names_iterator, 1):
+                    futures[executor.submit(download_single_blob, next_blob_name, download_directory)] = next_blob_name
+    if failed_downloads:
+        raise DownloadError(failed_downloads, output_paths)
+    return output_paths
+
+@contextlib.asynccontextmanager
+async def async_download_slot() -> AsyncIterator[None]:
+    """Holds one of the process-wide download slots (download_slots) without blocking the event loop.
+
+    The slots are shared with the threaded downloads, so async and threaded downloads running at the same time
+    stay under AZURE_MAX_PARALLEL_DOWNLOADS in total.
+    """
+    await download_slots.acquire_async()
+    try:
+        yield
+    finally:
+        download_slots.release()
+
+async def download_blob_async(container_client, blob_name: str, local_file_path: str, max_concurrency: int = 1, max_retries: int = 3) -> None:
+    """Downloads a single blob with an async container client, with retries and verification.
+
+    Like download_blob, the content is validated, the file is written to a temporary path first and stamped with the
+    blob last modified time, and each attempt holds one of the process-wide download slots during its transfer.
+
+    Args:
+        container_client (azure.storage.blob.aio.ContainerClient): The async client of the container.
+        blob_name (str): The name of the blob to download.
+        local_file_path (str): The local path to save the blob to.
+        max_concurrency (int, optional): The maximum number of parallel connections to use. Defaults to 1.
+        max_retries (int, optional): The maximum number of retries. Defaults to 3.
+
+    Raises:
+        Exception: if the blob could not be downloaded after max_retries attempts.
+    """
+    temp_path = local_file_path + '.temp'
+    for attempt in range(max_retries):
+        if attempt > 0:
+            await asyncio.sleep(min(MAX_RETRY_DELAY, 2 ** (attempt - 1) + random.random()))
+        try:
+            async with async_download_slot():
+                download_stream = await container_client.get_blob_client(blob_name).download_blob(max_concurrency=max_concurrency, validate_content=True)
+                expected_size = download_stream.properties.size
+                with open(temp_path, "wb", buffering=WRITE_BUFFER_SIZE) as file:
+                    preallocate_file(file.fileno(), expected_size)
+                    written_size = await download_stream.readinto(file)
+            if written_size == expected_size:
+                last_modified = download_stream.properties.last_modified.timestamp()
+                os.utime(temp_path, (last_modified, last_modified))
+                os.replace(temp_path, local_file_path)
+                return
+            logger.warning(f"Size verification failed for {local_file_path}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        except Exception as e:
+            logger.warning(f"Error downloading {local_file_path} (attempt {attempt + 1}): {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            if attempt == max_retries - 1:
+                raise Exception(f"Failed to download {blob_name} to {local_file_path} after {max_retries} attempts. {e}")
+    raise Exception(f"Failed to download {blob_name} to {local_file_path}: size verification failed after {max_retries} attempts")
+
+async def download_blobs_async(sas_url: str, blob_names: List[str], download_directory: str,
+                               max_workers: int = 32, max_concurrency: int = 1, prefix_to_remove: str = "") -> List[str]:
+    """Downloads multiple blobs concurrently on a single event loop.
+
+    Requires the optional "async" dependencies (aiohttp).
+
+    Args:
+        sas_url (str): The SAS URL for the container.
+        blob_names (List[str]): The list of blob names to download.
+        download_directory (str): The directory to download the blobs to.
+        max_workers (int, optional): The maximum number of blobs downloaded at the same time, on top of the process-wide
+            download slots. Defaults to 32.
+        max_concurrency (int, optional): The maximum number of parallel connections for each download. Defaults to 1.
+        prefix_to_remove (str, optional): The prefix to remove from the blob name when creating the local file path. Defaults to "".
+
+    Raises:
+        DownloadError: if some blobs could not be downloaded. It holds the failures and the paths that were downloaded.
+
+    Returns:
+        List[str]: list of paths of the downloaded blobs.
+    """
+    from azure.storage.blob.aio import ContainerClient as AsyncContainerClient
+
+    os.makedirs(download_directory, exist_ok=True)
+    created_dirs = {download_directory}
+    semaphore = asyncio.Semaphore(max_workers)
+
+    async with AsyncContainerClient.from_container_url(container_url=sas_url) as container_client:
+
+        async def download_single_blob(blob_name: str) -> str:
+            local_path = get_local_blob_path(blob_name, download_directory, prefix_to_remove)
+            local_dir = os.path.dirname(local_path)
+            if local_dir not in created_dirs:
+                os.makedirs(local_dir, exist_ok=True)
+                created_dirs.add(local_dir)
+            async with semaphore:
+                await download_blob_async(container_client, blob_name, local_path, max_concurrency)
+            return local_path
+
+        # One failed blob must not cancel or hide the other downloads
+        results = await asyncio.gather(*(download_single_blob(blob_name) for blob_name in blob_names), return_exceptions=True)
+
+    output_paths = []
+    failed_downloads = []
+    for blob_name, result in zip(blob_names, results):
+        if isinstance(result, BaseException):
+            failed_downloads.append((blob_name, result))
+        else:
+            output_paths.append(result)
+    if failed_downloads:
+        raise DownloadError(failed_downloads, output_paths)
+    return output_paths
+
+@functools.lru_cache(maxsize=1)
+def _is_aiohttp_installed() -> bool:
+    return importlib.util.find_spec("aiohttp") is not None
+
+async def _download_files_with_prefix(container_client, prefix: str, download_dir: str,
+                                     max_workers: int = 32, max_concurrency: int = 1) -> List[str]:
+    """Downloads all files with a specific prefix with an async container client. See download_files_with_prefix_async."""
+    os.makedirs(download_dir, exist_ok=True)
+    created_dirs = {download_dir}
+    output_paths = []
+    failed_downloads = []
+    # Bounded, so that a long listing does not get far ahead of the downloads
+    blob_queue = asyncio.Queue(maxsize=2 * max_workers)
+
+    async def download_single_blob(blob) -> str:
+        local_path = get_local_blob_path(blob.name, download_dir, prefix)
+        if is_local_file_up_to_date(local_path, blob.size, blob.last_modified):
+            return local_path
+        local_dir = os.path.dirname(local_path)
+        if local_dir not in created_dirs:
+            os.makedirs(local_dir, exist_ok=True)
+            created_dirs.add(local_dir)
+        await download_blob_async(container_client, blob.name, local_path, max_concurrency)
+        return local_path
+
+    async def list_blobs() -> None:
+        # Downloads start with the first listing page instead of waiting for the whole listing
+        try:
+            async for blob in container_client.list_blobs(name_starts_with=prefix, results_per_page=LISTING_PAGE_SIZE):
+                await blob_queue.put(blob)
+        finally:
+            for _ in range(max_workers):
+                await blob_queue.put(None)
+
+    async def download_worker() -> None:
+        while (blob := await blob_queue.get()) is not None:
             try:
-                local_path = future.result()
-                output_paths.append(local_path)
+                output_paths.append(await download_single_blob(blob))
             except Exception as e:
-                failed_downloads.append(blob_name)
-                error = str(e)
-                raise Exception(f"Failed to download {blob_name}: {error}")
+                failed_downloads.append((blob.name, e))
+
+    listing_result, *_ = await asyncio.gather(list_blobs(), *(download_worker() for _ in range(max_workers)), return_exceptions=True)
+
+    if isinstance(listing_result, BaseException):
+        raise listing_result
+    if failed_downloads:
+        raise DownloadError(failed_downloads, output_paths)
     return output_paths
 
+async def download_files_with_prefix_async(sas_url: str, prefix: str, download_dir: str,
+                                           max_workers: int = 32, max_concurrency: int = 1) -> List[str]:
+    """Downloads all files with a specific prefix from a container on a single event loop.
+
+    The listing and the downloads share one async client. Files already downloaded from the same version of a blob
+    (same size and last modified time as in the listing) are kept without any request.
+    Requires the optional "async" dependencies (aiohttp).
+
+    Args:
+        sas_url (str): The SAS URL for the container.
+        prefix (str): The prefix to filter the blobs with.
+        download_dir (str): The directory to download the files to.
+        max_workers (int, optional): The maximum number of blobs downloaded at the same time, on top of the process-wide
+            download slots. Defaults to 32.
+        max_concurrency (int, optional): The maximum number of parallel connections for each download. Defaults to 1.
+
+    Raises:
+        DownloadError: if some blobs could not be downloaded. It holds the failures and the paths that were downloaded.
+
+    Returns:
+        List[str]: list of paths of the downloaded files.
+    """
+    from azure.storage.blob.aio import ContainerClient as AsyncContainerClient
+
+    async with AsyncContainerClient.from_container_url(container_url=sas_url) as container_client:
+        return await _download_files_with_prefix(container_client, prefix, download_dir, max_workers=max_workers,
+                                                 max_concurrency=max_concurrency)
+
+class AsyncDownloader:
+    """Runs async downloads from synchronous code, on an event loop running in a background thread.
+
+    Async clients are bound to the event loop they were opened on: keeping one loop alive lets every call reuse the same
+    async client (and its connections) for a container, instead of opening a new one for each call.
+    Requires the optional "async" dependencies (aiohttp).
+    """
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        # Only used from the loop thread
+        self._container_clients = {}
+        self._thread = threading.Thread(target=self._loop.run_forever, name="async-downloads", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def is_available() -> bool:
+        """Checks whether the optional "async" dependencies (aiohttp) are installed.
+
+        Returns:
+            bool: True if the async downloads can be used, False otherwise.
+        """
+        return _is_aiohttp_installed()
+
+    def _get_container_client(self, sas_url: str):
+        from azure.storage.blob.aio import ContainerClient as AsyncContainerClient
+
+        container_client = self._container_clients.get(sas_url)
+        if container_client is None:
+            container_client = AsyncContainerClient.from_container_url(container_url=sas_url)
+            self._container_clients[sas_url] = container_client
+        return container_client
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def download_files_with_prefix(self, sas_url: str, prefix: str, download_dir: str,
+                                   max_workers: int = 32, max_concurrency: int = 1) -> List[str]:
+        """Downloads all files with a specific prefix from a container. See download_files_with_prefix_async.
+
+        Args:
+            sas_url (str): The SAS URL for the container.
+            prefix (str): The prefix to filter the blobs with.
+            download_dir (str): The directory to download the files to.
+            max_workers (int, optional): The maximum number of blobs downloaded at the same time, on top of the process-wide
+                download slots. Defaults to 32.
+            max_concurrency (int, optional): The maximum number of parallel connections for each download. Defaults to 1.
+
+        Raises:
+            DownloadError: if some blobs could not be downloaded. It holds the failures and the paths that were downloaded.
+
+        Returns:
+            List[str]: list of paths of the downloaded files.
+        """
+        async def download() -> List[str]:
+            return await _download_files_with_prefix(self._get_container_client(sas_url), prefix, download_dir,
+                                                     max_workers=max_workers, max_concurrency=max_concurrency)
+        return self._run(download())
+
+    def close(self) -> None:
+        """Closes the async clients and stops the event loop."""
+        if self._loop.is_closed():
+            return
+
+        async def close_container_clients() -> None:
+            for container_client in self._container_clients.values():
+                await container_client.close()
+            self._container_clients.clear()
+
+        try:
+            self._run(close_container_clients())
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+
+def iter_blob_names_with_prefix(sas_url: str, prefix: str) -> Iterator[str]:
+    """Lazily yields the names of blobs with a specific prefix in a container, page after page.
+
+    Args:
+        sas_url (str): The SAS URL for the container.
+        prefix (str): The prefix to filter the blobs with.
+
+    Returns:
+        Iterator[str]: The blob names.
+    """
+    container_client = get_cached_container_client(sas_url)
+    blob_list = container_client.list_blobs(name_starts_with=prefix, results_per_page=LISTING_PAGE_SIZE)
+    for blob in blob_list:
+        yield blob.name
+
 def list_blob_names_with_prefix(sas_url: str, prefix: str) -> List[str]:
     """Lists the names of blobs with a specific prefix in a container.
 
@@ -171,23 +782,21 @@ def list_blob_names_with_prefix(sas_url: str, prefix: str) -> List[str]:
     Returns:
         List[str]: A list of blob names.
     """
-    container_client = ContainerClient.from_container_url(container_url=sas_url)
-    blob_list = container_client.list_blobs(name_starts_with=prefix)
-    return [blob.name for blob in blob_list]
+    return list(iter_blob_names_with_prefix(sas_url, prefix))
 
-def download_files_with_prefix_parallel(sas_url: str, prefix: str, download_dir: str, max_workers=8)->List[str]:
+def download_files_with_prefix_parallel(sas_url: str, prefix: str, download_dir: str, max_workers: Optional[int] = None)->List[str]:
     """Downloads all files with a specific prefix from a container in parallel.
 
     Args:
         sas_url (str): The SAS URL for the container.
         prefix (str): The prefix to filter the blobs with.
         download_dir (str): The directory to download the files to.
-        max_workers (int, optional): The maximum number of worker threads. Defaults to 8.
+        max_workers (int, optional): The maximum number of worker threads. Defaults to None, which scales it with the number of blobs.
 
     Returns:list of paths the downloaded files 
     """
     os.makedirs(download_dir, exist_ok=True)
 
-    # List blobs with the specified prefix
-    blob_names= list_blob_names_with_prefix(sas_url, prefix)
+    # List blobs with the specified prefix lazily: downloads start as soon as the first page is returned
+    blob_names= iter_blob_names_with_prefix(sas_url, prefix)
     return download_blobs_in_parallel(sas_url=sas_url, blob_names=blob_names, download_directory=download_dir, max_workers=max_workers,prefix_to_remove= prefix)
@@ -1,16 +1,18 @@
 import logging
 import os
-from typing import Dict, List, Tuple
-
-from azure.storage.blob import ContainerClient
+import posixpath
+import threading
+import weakref
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
 
 from .azure_storage_client import AzureStorageClient
 
 from ..ncp_file_manager_class import NCPFileManager
-from ..image_naming import ImageType
+from ..image_naming import IMAGE_TYPE_VALUES, ImageType
 from ..const import allowed_image_extensions,ContainerTypeEnum,L2R_ResultFile, NCP_ResultFile
 from ..blob_storage_structure import BlobStorageStructure, ContainerBase
-from .azure_download_blobs import download_blobs_in_parallel, download_files_with_prefix_parallel
+from ..settings import AZURE_MAX_PARALLEL_DOWNLOADS
+from .azure_download_blobs import AsyncDownloader, download_blobs_in_parallel, download_files_with_prefix_parallel, get_cached_container_client
 from .azure_upload_files_to_blobs import upload_file_to_azure, upload_folder_to_azure_parallel
 
 logger = logging.getLogger(__name__)
@@ -22,13 +24,23 @@ class AzureManager(NCPFileManager):
     def __init__(self, blob_storage_structure:BlobStorageStructure | dict, instance_id:str,use_record_dir=True):
         super().__init__(blob_storage_structure, instance_id, use_record_dir)
         self.blobStorageClient = AzureStorageClient.get_instance()
+        self._async_downloader = None
+        self._async_downloader_lock = threading.Lock()
+
+    def _get_async_downloader(self)->AsyncDownloader:
+        """Gets the async downloader of the manager, created on first use. It is closed when the manager is garbage collected."""
+        with self._async_downloader_lock:
+            if self._async_downloader is None:
+                self._async_downloader = AsyncDownloader()
+                weakref.finalize(self, self._async_downloader.close)
+            return self._async_downloader
 
     def get_downloaded_blob_name(self, blob_name:str, download_directory:str=None)->str:
         prefix_to_remove= self.record_prefix + '/'
         if download_directory is None or download_directory == "":
             download_directory=self.input_dir
         
-        if prefix_to_remove !="" and prefix_to_remove in blob_name:
+        if prefix_to_remove and blob_name.startswith(prefix_to_remove):
             blob_path = blob_name[len(prefix_to_remove):]
         else:
             blob_path = blob_name
@@ -46,7 +58,7 @@ class AzureManager(NCPFileManager):
         """
         return [self.get_downloaded_blob_name(path) for path in blob_names]
     
-    def download_blobs_in_parallel(self, container_type:ContainerTypeEnum, blob_names:List[str], download_directory:str="",max_workers: int = 4, max_concurrency: int = 4, prefix_to_remove:str="")->List[str]:
+    def download_blobs_in_parallel(self, container_type:ContainerTypeEnum, blob_names:List[str], download_directory:str="",max_workers: Optional[int] = None, max_concurrency: int = 4, prefix_to_remove:str="")->List[str]:
         """Downloads a list of blobs in parallel from the specified container.
         
         Args:
@@ -60,7 +72,7 @@ class AzureManager(NCPFileManager):
         if download_directory=="":
             download_directory=self.input_dir
         sas_url = self.blobStorageStructure.get_container(container_type).sas_url
-        return download_blobs_in_parallel(sas_url, blob_names, download_directory,max_workers=max_workers, prefix_to_remove=prefix_to_remove)
+        return download_blobs_in_parallel(sas_url, blob_names, download_directory,max_workers=max_workers, max_concurrency=max_concurrency, prefix_to_remove=prefix_to_remove)
 
     def _download_blobs_with_prefix_parallel(self, container_type:ContainerTypeEnum, prefix:str, download_directory:str="")->List[str]:
         """Downloads blobs with a specific prefix in parallel from the specified container.
@@ -76,6 +88,9 @@ class AzureManager(NCPFileManager):
         if download_directory=="":
             download_directory=self.input_dir
         sas_url = self.blobStorageStructure.get_container(container_type).sas_url
+        if AsyncDownloader.is_available():
+            # Small frames are latency bound: a single event loop keeps many more requests in flight than worker threads
+            return self._get_async_downloader().download_files_with_prefix(sas_url, prefix, download_directory, max_workers=AZURE_MAX_PARALLEL_DOWNLOADS)
         return download_files_with_prefix_parallel(sas_url, prefix, download_directory)
     
     def _download_blob(self, container_type:ContainerTypeEnum,blob_name:str, download_directory:str="", remove_prefix=True)-> str:
@@ -148,7 +163,8 @@ class AzureManager(NCPFileManager):
             List[str]: list of blob names.
         """
         output_blob_prefix= self.blobStorageStructure.record_prefix
-        output_blob_prefix=os.path.join(output_blob_prefix, blob_prefix).replace("\\","/")
+        # Blob names always use "/": posixpath joins them the same way on every OS
+        output_blob_prefix=posixpath.join(output_blob_prefix, blob_prefix)
         return self.upload_folder_to_cloud_parallel(container_type=container_type,local_folder_path=local_folder_path,output_blob_prefix=output_blob_prefix,remove_files=remove_files)
     
     def upload_record_file_to_cloud(self, container_type:ContainerTypeEnum,file_to_upload_path:str, blob_name:str, remove_file:bool = False)-> str:
@@ -167,33 +183,42 @@ class AzureManager(NCPFileManager):
         blob_name= upload_file_to_azure(file_to_upload_path, self.record_prefix+blob_name, sas_url, remove=remove_file)
         return blob_name
 
-    def get_list_of_blob_names(self, container_type:ContainerTypeEnum, prefix:str="", extensions:List[str]=[])-> List[str]:
-        """Gets a list of blob names from the specified container with a given prefix and extensions.
+    def iter_blob_names(self, container_type:ContainerTypeEnum, prefix:str="", extensions:Sequence[str]=())-> Iterator[str]:
+        """Lazily yields blob names from the specified container with a given prefix and extensions, page after page.
         
         Args:
             container_type (ContainerTypeEnum): The type of container to list from.
             prefix (str, optional): The prefix to filter the blobs with. Defaults to "".
-            extensions (List[str], optional): The list of extensions to filter the blobs with. Defaults to [].
+            extensions (Sequence[str], optional): The extensions to filter the blobs with. Defaults to (), which keeps all blobs.
             
         Returns:
-            List[str]: A list of blob names.
+            Iterator[str]: The blob names.
         """
 
         sas_url = self.blobStorageStructure.get_container(container_type).sas_url
         
-        container_client = ContainerClient.from_container_url(
-            container_url=sas_url
-        )
+        container_client = get_cached_container_client(sas_url)
 
         blob_list = container_client.list_blobs(
             name_starts_with=prefix
         )
-        blob_names = [
-            blob.name
-            for blob in blob_list
-            if os.path.splitext(blob.name)[1].lower() in extensions
-        ]
-        return blob_names
+        suffixes = tuple(extension.lower() if extension.startswith('.') else '.' + extension.lower() for extension in extensions)
+        for blob in blob_list:
+            if not suffixes or blob.name.lower().endswith(suffixes):
+                yield blob.name
+
+    def get_list_of_blob_names(self, container_type:ContainerTypeEnum, prefix:str="", extensions:Sequence[str]=())-> List[str]:
+        """Gets a list of blob names from the specified container with a given prefix and extensions.
+        
+        Args:
+            container_type (ContainerTypeEnum): The type of container to list from.
+            prefix (str, optional): The prefix to filter the blobs with. Defaults to "".
+            extensions (Sequence[str], optional): The extensions to filter the blobs with. Defaults to (), which keeps all blobs.
+            
+        Returns:
+            List[str]: A list of blob names.
+        """
+        return list(self.iter_blob_names(container_type, prefix, extensions))
     
     def get_list_of_frame_blob_names(self, container_type:ContainerTypeEnum, blob_name_should_include_text:str=None)->List[str]:
         """Gets a list of frame blob names from the specified container.
@@ -228,11 +253,12 @@ class AzureManager(NCPFileManager):
         """
         relative_frame_prefix = self.blobStorageStructure.get_frame_directory_prefix(container_type=container_type)
         frame_prefix = self.blobStorageStructure.get_cloud_blob_path_with_record_prefix(relative_frame_prefix)
-        blob_list= self.get_list_of_blob_names(container_type, frame_prefix, allowed_image_extensions)
+        # The enum value is resolved once, not for every listed blob
+        image_type = IMAGE_TYPE_VALUES[ImageType.CUBEMAP]
         blob_names = [
             blob_name
-            for blob_name in blob_list
-            if ImageType.CUBEMAP.value in blob_name
+            for blob_name in self.iter_blob_names(container_type, frame_prefix, allowed_image_extensions)
+            if image_type in blob_name
         ]
         return blob_names
     
@@ -247,11 +273,12 @@ class AzureManager(NCPFileManager):
         """
         relative_equirect_prefix = self.blobStorageStructure.get_equirect_directory_prefix(container_type=container_type)
         equirect_prefix = self.blobStorageStructure.get_cloud_blob_path_with_record_prefix(relative_equirect_prefix)
-        blob_list= self.get_list_of_blob_names(container_type, equirect_prefix, allowed_image_extensions)
+        # The enum value is resolved once, not for every listed blob
+        image_type = IMAGE_TYPE_VALUES[ImageType.EQUIRECT]
         blob_names = [
             blob_name
-            for blob_name in blob_list
-            if ImageType.EQUIRECT .value in blob_name
+            for blob_name in self.iter_blob_names(container_type, equirect_prefix, allowed_image_extensions)
+            if image_type in blob_name
         ]
         return blob_names
     
@@ -265,3 +292,15 @@ class AzureManager(NCPFileManager):
         properties = blob_client.get_blob_properties()
         return properties.size
     
+
+    def get_blob_sizes(self,container:ContainerBase,prefix:str)->Dict[str,int]:
+        """Gets the sizes of all blobs with a given prefix in one listing. Prefer it over get_blob_size in loops.
+        
+        Args:
+            container (ContainerBase): The container to list from.
+            prefix (str): The prefix to filter the blobs with.
+            
+        Returns:
+            Dict[str,int]: The size in bytes of each blob, by blob name.
+        """
+        return self.blobStorageClient.get_blob_sizes(container.name, prefix)
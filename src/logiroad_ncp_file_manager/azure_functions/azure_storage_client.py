@@ -1,13 +1,74 @@
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+import functools
+from itertools import islice
 import logging
-from typing import List
+import threading
+import time
+from typing import Iterable, Iterator, List, Optional
 from azure.storage.blob import BlobServiceClient, generate_blob_sas, BlobSasPermissions, generate_container_sas, ContainerSasPermissions, ContainerClient, StandardBlobTier
+from azure.core import MatchConditions
+from azure.core.exceptions import HttpResponseError, ResourceExistsError, ResourceNotFoundError
 from azure.core.pipeline.transport import HttpRequest
 from ..blob_storage_client import BlobStorageClient
+from .azure_download_blobs import LISTING_PAGE_SIZE, JitteredRetry, get_shared_transport
 from ..settings import *
 
 logger = logging.getLogger(__name__)
 
+DOWNLOAD_SAS_HOURS = 24
+BATCH_SIZE = 256
+# Blob properties read less than this many seconds ago are not requested again
+BLOB_PROPERTIES_CACHE_SECONDS = 60
+# Maximum number of blobs kept in the properties cache, the least recently used ones are evicted first
+BLOB_PROPERTIES_CACHE_SIZE = 4096
+
+def _fetch_next_page(pages:Iterator)->Optional[list]:
+    page = next(pages, None)
+    return None if page is None else list(page)
+
+def iter_prefetched_pages(pages:Iterator)->Iterator[list]:
+    """
+    Iterate over listing pages while the next one is fetched in the background.
+    Continuation tokens are sequential so pages cannot be requested concurrently, but the request for page N+1
+    overlaps with the processing of page N.
+
+    Args:
+        pages (Iterator): A page iterator, as returned by ItemPaged.by_page()
+
+    Returns:
+        Iterator[list]: The items of each page
+    """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(_fetch_next_page, pages)
+        while (page := future.result()) is not None:
+            future = executor.submit(_fetch_next_page, pages)
+            yield page
+
+def _count_batch_failures(responses:Iterable)->int:
+    """Counts (and logs) the failed sub-requests of a batch operation called with raise_on_any_failure=False."""
+    errors_count = 0
+    for response in responses:
+        if response.status_code >= 300:
+            errors_count += 1
+            logger.error(f"Batch sub-request failed with status {response.status_code}: {response.reason}")
+    return errors_count
+
+@functools.lru_cache(maxsize=4096)
+def _generate_cached_blob_download_sas_token(account_name:str, account_key:str, container_name:str, blob_name:str, hour_bucket:int)->str:
+    """Signs a blob read SAS token, reused for the rest of the current hour (hour_bucket) so it is always valid for 23+ more hours."""
+    return generate_blob_sas(
+        account_name=account_name,
+        container_name=container_name,
+        blob_name=blob_name,
+        account_key=account_key,
+        permission=BlobSasPermissions(read=True),
+        expiry=datetime.now(timezone.utc) + timedelta(hours=DOWNLOAD_SAS_HOURS)
+    )
+
+_INSTANCE = None
+
 class AzureStorageClient(BlobStorageClient):
     connection_string:str
     account_name:str
@@ -15,9 +76,12 @@ class AzureStorageClient(BlobStorageClient):
 
     @classmethod
     def get_instance(cls):
+        global _INSTANCE
         if AZURE_STORAGE_CONNECTION_STRING:   
-            client = cls()
-            return client
+            # A single client is shared by the whole process, with its connection pool
+            if _INSTANCE is None:
+                _INSTANCE = cls()
+            return _INSTANCE
         else:
             return None
     
@@ -40,10 +104,22 @@ class AzureStorageClient(BlobStorageClient):
                 f"EndpointSuffix=core.windows.net"
             )
         
-        self.blob_service_client = BlobServiceClient.from_connection_string(self.connection_string)
+        # The shared transport pools up to SHARED_POOL_SIZE connections per host (requests defaults to 10),
+        # so parallel uploads and downloads reuse warm connections instead of discarding them
+        self.blob_service_client = BlobServiceClient.from_connection_string(self.connection_string, transport=get_shared_transport(),
+                                                                           retry_policy=JitteredRetry())
+        self._container_clients:dict[str, ContainerClient] = {}
+        # LRU of (size, etag, time read) by (container name, blob name). The client is shared by threads, hence the lock
+        self._blob_properties_cache:OrderedDict[tuple[str, str], tuple[int, str, float]] = OrderedDict()
+        self._blob_properties_cache_lock = threading.Lock()
     
     def get_container_client(self, container_name:str)->ContainerClient:
-        return self.blob_service_client.get_container_client(container_name)
+        # Container clients share the service client pipeline, so they can be built once and reused
+        container_client = self._container_clients.get(container_name)
+        if container_client is None:
+            container_client = self.blob_service_client.get_container_client(container_name)
+            self._container_clients[container_name] = container_client
+        return container_client
 
     def create_record_container_pseudo_folder(self, container_name:str,record_path:str):
         """Create pseudo folder for a record"""
@@ -56,17 +132,16 @@ class AzureStorageClient(BlobStorageClient):
     
     def create_calibrations_container_pseudo_folder(self, container_name:str,calibrations_path:str):
         """Create pseudo folder for calibrations"""
-        #check if blob exists
-        blob_client = self.get_container_client(container_name).get_blob_client(calibrations_path)
-        if blob_client.exists():
-            logger.warning(f"Blob {calibrations_path} already exists.")
-            return
-        # Create a dummy blob to ensure the directory structure exists
-        self.get_container_client(container_name).upload_blob(
-            name=calibrations_path + ".keep",
-            data="",
-            overwrite=True
-        )
+        # Create a dummy blob to ensure the directory structure exists.
+        # The upload fails if it already exists, which saves a separate exists() request
+        try:
+            self.get_container_client(container_name).upload_blob(
+                name=calibrations_path + ".keep",
+                data="",
+                overwrite=False
+            )
+        except ResourceExistsError:
+            logger.warning(f"Blob {calibrations_path}.keep already exists.")
 
     def generate_sas_token(self, container_name:str,read=False,add=False,list = False,write=False, create=False, delete=False,hours=12):
         sas_token = generate_container_sas(
@@ -115,23 +190,93 @@ class AzureStorageClient(BlobStorageClient):
         return self.generate_url_with_permissions(container_name=container_name, read=True, list=True, write=False, create=False, delete=False,hours=hours)
     
     def generate_blob_download_url(self, container_name:str,blob_name:str)->str:
-        sas_token = self.generate_blob_download_sas_token(container_name=container_name, blob_name= blob_name)
+        # Signing is HMAC-SHA256 work: tokens are cached and reused for up to an hour
+        sas_token = _generate_cached_blob_download_sas_token(self.account_name, self.account_key, container_name, blob_name, int(time.time()) // 3600)
         return f"https://{self.account_name}.blob.core.windows.net/{container_name}/{blob_name}?{sas_token}"
 
+    def _get_cached_blob_properties(self, key:tuple[str, str])->Optional[tuple[int, str, float]]:
+        with self._blob_properties_cache_lock:
+            cached = self._blob_properties_cache.get(key)
+            if cached is not None:
+                self._blob_properties_cache.move_to_end(key)
+            return cached
+
+    def _cache_blob_properties(self, key:tuple[str, str], properties:tuple[int, str, float])->None:
+        with self._blob_properties_cache_lock:
+            self._blob_properties_cache[key] = properties
+            self._blob_properties_cache.move_to_end(key)
+            if len(self._blob_properties_cache) > BLOB_PROPERTIES_CACHE_SIZE:
+                self._blob_properties_cache.popitem(last=False)
+
+    def _evict_blob_properties(self, key:tuple[str, str])->None:
+        with self._blob_properties_cache_lock:
+            self._blob_properties_cache.pop(key, None)
+
+    def _get_cached_blob_size(self, container_name:str, blob_name:str)->int:
+        """
+        Get the size of a blob, from the cache when it was read less than BLOB_PROPERTIES_CACHE_SECONDS ago.
+        An older entry is revalidated with its ETag: an unchanged blob answers 304 Not Modified, without its properties.
+        The blob client reports the 304 as a plain HttpResponseError, not as a ResourceNotModifiedError.
+
+        Raises:
+            ResourceNotFoundError: If the blob does not exist
+        """
+        key = (container_name, blob_name)
+        cached = self._get_cached_blob_properties(key)
+        now = time.monotonic()
+        if cached is not None and now - cached[2] < BLOB_PROPERTIES_CACHE_SECONDS:
+            return cached[0]
+
+        blob_client = self.get_container_client(container_name=container_name).get_blob_client(blob_name)
+        try:
+            if cached is None:
+                properties = blob_client.get_blob_properties()
+            else:
+                properties = blob_client.get_blob_properties(etag=cached[1], match_condition=MatchConditions.IfModified)
+        except ResourceNotFoundError:
+            self._evict_blob_properties(key)
+            raise
+        except HttpResponseError as e:
+            if cached is None or e.status_code != 304:
+                raise
+            self._cache_blob_properties(key, (cached[0], cached[1], now))
+            return cached[0]
+        self._cache_blob_properties(key, (properties.size, properties.etag, now))
+        return properties.size
+
     def check_blob_exists(self, container_name:str,blob_name:str)->bool:
+        # Not answered from the properties cache: the blob may have been deleted by another client since it was cached
         container_client = self.get_container_client(container_name=container_name)
-        blob_client = container_client.get_blob_client(blob_name)
-        return blob_client.exists()
+        exists = container_client.get_blob_client(blob_name).exists()
+        if not exists:
+            self._evict_blob_properties((container_name, blob_name))
+        return exists
 
     def get_blob_size(self, container_name:str,blob_name:str)->int:
+        # A blob deleted or overwritten by another client can still be reported with its cached size
+        # for up to BLOB_PROPERTIES_CACHE_SECONDS
+        return self._get_cached_blob_size(container_name, blob_name)
+
+    def get_blob_sizes(self, container_name:str, prefix:str)->dict[str, int]:
+        """
+        Get the sizes of all blobs starting with the given prefix, from a single paginated listing.
+        Prefer it over calling get_blob_size for each blob of a known prefix (one request per 5000 blobs instead of one per blob).
+
+        Args:
+            container_name (str): The name of the container
+            prefix (str): The prefix to filter blobs by
+
+        Returns:
+            dict[str, int]: The size in bytes of each blob, by blob name
+        """
         container_client = self.get_container_client(container_name=container_name)
-        blob_client = container_client.get_blob_client(blob_name)
-        properties = blob_client.get_blob_properties()
-        return properties.size
+        # Not added to the properties cache: a large listing would only evict the entries actually reused
+        return {blob.name: blob.size for blob in container_client.list_blobs(name_starts_with=prefix)}
         
     def list_blob_download_urls(self, container_name:str, prefix:str)->list[str]:
         """
         List all blobs starting with the given prefix and return their download URLs.
+        Each URL carries a read-only SAS token scoped to its own blob, valid for at least 23 hours.
         
         Args:
             container_name (str): The name of the container
@@ -142,27 +287,21 @@ class AzureStorageClient(BlobStorageClient):
         """
         container_client = self.get_container_client(container_name=container_name)
         
-        # List all blobs with the given prefix
-        blob_list = container_client.list_blobs(name_starts_with=prefix)
+        # Only names are needed: list_blob_names skips building a BlobProperties per blob
+        pages = container_client.list_blob_names(name_starts_with=prefix, results_per_page=LISTING_PAGE_SIZE).by_page()
         
-        # Generate download URLs for each blob
+        # Generate download URLs for each blob. The per-blob tokens are cached, so repeated listings don't sign them again
         download_urls = []
-        for blob in blob_list:
-            # Skip directory markers or empty blobs
-            if blob.name.endswith('.keep') or blob.size == 0:
-                continue
-                
-            download_url = self.generate_blob_download_url(
-                container_name=container_name,
-                blob_name=blob.name
-            )
-            download_urls.append(download_url)
+        for page in iter_prefetched_pages(pages):
+            # Skip directory markers
+            download_urls += [self.generate_blob_download_url(container_name, blob_name) for blob_name in page if not blob_name.endswith('.keep')]
             
         return download_urls
         
     def list_blob_download_urls_with_folders(self, container_name:str, prefix:str)->dict[str, list[str]]:
         """
         List all blobs starting with the given prefix, grouped by pseudo folders, and return their download URLs.
+        Each URL carries a read-only SAS token scoped to its own blob, valid for at least 23 hours.
         
         Args:
             container_name (str): The name of the container
@@ -176,40 +315,23 @@ class AzureStorageClient(BlobStorageClient):
             prefix+="/"
         container_client = self.get_container_client(container_name=container_name)
         
-        # List all blobs with the given prefix
-        blob_list = container_client.list_blobs(name_starts_with=prefix)
+        # Only names are needed: list_blob_names skips building a BlobProperties per blob
+        pages = container_client.list_blob_names(name_starts_with=prefix, results_per_page=LISTING_PAGE_SIZE).by_page()
         
         # Group blobs by folder
-        folders = {}
+        folders = defaultdict(list)
         folders["root"] = []  # Special key for blobs directly in the prefix
+        prefix_length = len(prefix)
         
-        for blob in blob_list:
-            # Skip directory markers or empty blobs
-            if blob.name.endswith('.keep') or blob.size == 0:
-                continue
+        for page in iter_prefetched_pages(pages):
+            for blob_name in page:
+                # Skip directory markers
+                if blob_name.endswith('.keep'):
+                    continue
                 
-            # Generate download URL
-            download_url = self.generate_blob_download_url(
-                container_name=container_name,
-                blob_name=blob.name
-            )
-            
-            # Extract the relative path from the prefix
-            relative_path = blob.name[len(prefix):]
-            
-            # Check if the blob is in a subfolder
-            if '/' in relative_path:
-                # Extract the folder path
-                folder_path = relative_path.split('/')[0]
-                # Initialize the folder list if it doesn't exist
-                if folder_path not in folders:
-                    folders[folder_path] = []
-                    
-                # Add the download URL to the folder list
-                folders[folder_path].append(download_url)
-            else:
-                # Add the download URL to the root list
-                folders["root"].append(download_url)
+                # The first part of the path relative to the prefix is the folder, if the blob is in a subfolder
+                folder_path, separator, _ = blob_name[prefix_length:].partition('/')
+                folders[folder_path if separator else "root"].append(self.generate_blob_download_url(container_name, blob_name))
         # Remove empty folders
         folders = {k: v for k, v in folders.items() if v}
             
@@ -218,7 +340,10 @@ class AzureStorageClient(BlobStorageClient):
     def delete_blobs_by_prefix(self, container_name: str, prefix: str) -> int:
         """
         Deletes all blobs within a specified container that match a given prefix
-        using a batch operation.
+        using batch operations.
+        Names are streamed from the listing into batches of BATCH_SIZE blobs (the batch API limit),
+        so deletions start before the listing completes and the names are never all held in memory.
+        The next listing page is fetched in the background while the current one is being deleted.
 
         Args:
             container_name (str): The name of the container.
@@ -228,50 +353,33 @@ class AzureStorageClient(BlobStorageClient):
             int: The number of blobs submitted for deletion.
         """
         container_client = self.get_container_client(container_name=container_name)
-        blob_list = container_client.list_blobs(name_starts_with=prefix)
-        
-        blobs_to_delete = [blob.name for blob in blob_list if not blob.name.endswith('/.keep')] # Ensure we don't delete our pseudo-folder markers
-        
-        if not blobs_to_delete:
-            logger.debug(f"No blobs found with prefix '{prefix}' in container '{container_name}' to delete.")
-            return 0
+        pages = container_client.list_blob_names(name_starts_with=prefix, results_per_page=LISTING_PAGE_SIZE).by_page()
+        # Ensure we don't delete our pseudo-folder markers
+        blob_names = (blob_name for page in iter_prefetched_pages(pages) for blob_name in page if not blob_name.endswith('/.keep'))
 
-        logger.debug(f"Attempting to batch delete {len(blobs_to_delete)} blobs with prefix '{prefix}' in container '{container_name}'.")
-        
+        nb_submitted = 0
+        errors_count = 0
         try:
-            # The delete_blobs operation can take an iterable of blob names.
-            # It's a more efficient way to delete multiple blobs.
-            results = container_client.delete_blobs(*blobs_to_delete)
-            # The `results` object is an iterator. Successfully queued deletions might not raise an error immediately.
-            # For simplicity, we'll assume success if no immediate exception is raised by the call.
-            # Proper error handling for partial failures in batch operations can be complex
-            # and might involve checking each item in the `results` iterator if the SDK version provides such details.
-            # For now, we return the count of blobs submitted.
-            
-            # Iterate through results to check for errors, if the SDK provides this.
-            # Some versions/operations might raise AzureBatchOperationError for partial failures.
-            # For azure-storage-blob, delete_blobs returns an iterator of responses (None for success, exception for failure).
-            successful_deletions = 0
-            errors_count = 0
-            for result in results:
-                if result is None: # Assuming None means success for that specific blob
-                    successful_deletions +=1
-                else: # An exception object indicates failure for that blob
-                    errors_count +=1
-                    logger.error(f"Failed to delete a blob: {result}")
-
-            if errors_count > 0:
-                logger.error(f"Batch deletion completed with {errors_count} errors out of {len(blobs_to_delete)} submitted.")
-            else:
-                logger.debug(f"Successfully submitted batch deletion request for {len(blobs_to_delete)} blobs.")
-            
-            return len(blobs_to_delete) # Return total submitted, or successful_deletions for more accuracy
+            while batch := list(islice(blob_names, BATCH_SIZE)):
+                # delete_blobs returns one response per blob, failed sub-requests included
+                errors_count += _count_batch_failures(container_client.delete_blobs(*batch, raise_on_any_failure=False))
+                nb_submitted += len(batch)
+                for blob_name in batch:
+                    self._evict_blob_properties((container_name, blob_name))
         except Exception as e:
-            # This would catch errors like authentication issues, container not found, or if the batch operation itself fails.
-            logger.error(f"An error occurred during batch deletion for prefix '{prefix}' in container '{container_name}': {str(e)}")
-            # Depending on the exception, it might indicate total failure or partial.
-            # For a general exception here, assume all submitted blobs failed.
-            return 0
+            # This would catch errors like authentication issues, container not found, or if a batch operation itself fails.
+            # Blobs of the previous batches are already deleted.
+            logger.error(f"An error occurred during batch deletion for prefix '{prefix}' in container '{container_name}' after {nb_submitted} blobs: {str(e)}")
+            return nb_submitted
+
+        if nb_submitted == 0:
+            logger.debug(f"No blobs found with prefix '{prefix}' in container '{container_name}' to delete.")
+        elif errors_count > 0:
+            logger.error(f"Batch deletion completed with {errors_count} errors out of {nb_submitted} submitted.")
+        else:
+            logger.debug(f"Successfully submitted batch deletion requests for {nb_submitted} blobs with prefix '{prefix}' in container '{container_name}'.")
+
+        return nb_submitted
 
     def change_blob_access_tier(self, container_name: str, blob_name: str, access_tier: StandardBlobTier) -> bool:
         """
@@ -294,3 +402,28 @@ class AzureStorageClient(BlobStorageClient):
             logger.error(f"Failed to change access tier for blob '{blob_name}' in container '{container_name}': {str(e)}")
             return False
 
+    def change_blob_access_tiers(self, container_name: str, blob_names: Iterable[str], access_tier: StandardBlobTier) -> int:
+        """
+        Change the access tier of several blobs in the specified container, with batch operations
+        of up to BATCH_SIZE blobs each instead of one request per blob.
+
+        Args:
+            container_name (str): The name of the container.
+            blob_names (Iterable[str]): The names of the blobs.
+            access_tier (StandardBlobTier): The new access tier to set for the blobs.
+
+        Returns:
+            int: The number of blobs whose access tier was changed.
+        """
+        container_client = self.get_container_client(container_name)
+        blob_names = iter(blob_names)
+        nb_changed = 0
+        try:
+            while batch := list(islice(blob_names, BATCH_SIZE)):
+                errors_count = _count_batch_failures(container_client.set_standard_blob_tier_blobs(access_tier, *batch, raise_on_any_failure=False))
+                nb_changed += len(batch) - errors_count
+        except Exception as e:
+            logger.error(f"An error occurred during batch access tier change in container '{container_name}' after {nb_changed} blobs: {str(e)}")
+            return nb_changed
+        logger.info(f"Changed access tier of {nb_changed} blobs in container '{container_name}' to '{access_tier}'.")
+        return nb_changed
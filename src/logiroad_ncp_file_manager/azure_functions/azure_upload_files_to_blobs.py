@@ -1,57 +1,81 @@
+import asyncio
+import io
 import logging
 import os
-from concurrent.futures import ThreadPoolExecutor
-from threading import Thread, Lock
-from queue import Queue, Empty
-from typing import Dict, List, Tuple
-from azure.storage.blob import BlobClient
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Event, Lock, Thread
+from queue import Empty, Full, Queue
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+from azure.storage.blob import ContainerClient
+from .azure_download_blobs import UPLOAD_SINGLE_PUT_SIZE, get_cached_container_client
 
 logger = logging.getLogger(__name__)
 
+# How often (in seconds) idle upload threads check whether they must stop
+STOP_POLL_INTERVAL = 0.1
+# Files of a folder are already uploaded in parallel, so each of them uses fewer connections
+FOLDER_UPLOAD_MAX_CONCURRENCY = 2
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
 class BlobData:
     """Data class for blob data."""
-    data:List[bytes]
+    data:BytesLike
     blob_name=""
-    def __init__(self, data:List[bytes], blob_name:str):
+    def __init__(self, data:BytesLike, blob_name:str):
         """Initializes the BlobData.
 
         Args:
-            data (List[bytes]): The data of the blob.
+            data (BytesLike): The data of the blob. Buffers (bytearray, memoryview) don't need to be copied to bytes beforehand.
             blob_name (str): The name of the blob.
         """
         self.data=data
         self.blob_name = blob_name
 
-def upload_data_to_azure(data_to_upload: bytes, blob_name: str, sas_url: str)->bool:
-    """Uploads data to Azure Blob Storage.
+def upload_data_to_container(data_to_upload: BytesLike, blob_name: str, container_client: ContainerClient)->bool:
+    """Uploads data to Azure Blob Storage with an existing ContainerClient, sharing its pipeline and connections.
 
     Args:
-        data_to_upload (bytes): The data to upload.
+        data_to_upload (BytesLike): The data to upload.
         blob_name (str): The name of the blob.
-        sas_url (str): The SAS URL for the container.
+        container_client (ContainerClient): The client of the destination container.
 
     Returns:
         bool: True if the upload is successful, False otherwise.
     """
     try:
         # Validate input type
+        if not isinstance(data_to_upload, (bytes, bytearray, memoryview)):
+            raise TypeError("data_to_upload must be a bytes-like object (bytes, bytearray or memoryview).")
         if not isinstance(data_to_upload, bytes):
-            raise TypeError("data_to_upload must be of type bytes.")
+            # The SDK takes bytes or streams only. BytesIO copies the buffer here, once, when the blob is uploaded
+            # (the copy is not kept while the blob waits in a queue). Bytes are passed as is: the SDK wraps them
+            # in a BytesIO that shares their memory
+            data_to_upload = io.BytesIO(memoryview(data_to_upload).cast("B"))
 
-        # Append the blob name to the container SAS URL to form the full blob URL
-        blob_url = f"{sas_url.split('?')[0]}/{blob_name}?{sas_url.split('?')[1]}"
-        # Create a BlobClient
-        blob_client = BlobClient.from_blob_url(blob_url)
         # Upload data
-        blob_client.upload_blob(data_to_upload, overwrite=True)
+        container_client.get_blob_client(blob_name).upload_blob(data_to_upload, overwrite=True)
 
         return True
     except Exception as e:
         logger.error(f"Error uploading {blob_name}: {str(e)}")
         return False
+
+def upload_data_to_azure(data_to_upload: BytesLike, blob_name: str, sas_url: str)->bool:
+    """Uploads data to Azure Blob Storage.
+
+    Args:
+        data_to_upload (BytesLike): The data to upload.
+        blob_name (str): The name of the blob.
+        sas_url (str): The SAS URL for the container.
+
+    Returns:
+        bool: True if the upload is successful, False otherwise.
+    """
+    return upload_data_to_container(data_to_upload, blob_name, get_cached_container_client(sas_url))
     
 
-def upload_file_to_azure(file_to_upload_path: str, blob_name: str, sas_url: str, remove: bool = False)->str:
+def upload_file_to_azure(file_to_upload_path: str, blob_name: str, sas_url: str, remove: bool = False, max_concurrency: int = 4)->str:
     """Uploads a file to Azure Blob Storage.
 
     Args:
@@ -59,20 +83,18 @@ def upload_file_to_azure(file_to_upload_path: str, blob_name: str, sas_url: str,
         blob_name (str): The name of the blob.
         sas_url (str): The SAS URL for the container.
         remove (bool, optional): Whether to remove the file after upload. Defaults to False.
+        max_concurrency (int, optional): The maximum number of blocks uploaded in parallel, for files large enough to be split. Defaults to 4.
 
     Returns:
         str: The name of the blob if the upload is successful, None otherwise.
     """
     try:
-        # Append the blob name to the container SAS URL to form the full blob URL
-        blob_url = f"{sas_url.split('?')[0]}/{blob_name}?{sas_url.split('?')[1]}"
-
-        # Create a BlobClient
-        blob_client = BlobClient.from_blob_url(blob_url)
+        # The container client is cached per SAS URL, so its pipeline and connections are reused across uploads
+        blob_client = get_cached_container_client(sas_url).get_blob_client(blob_name)
 
         # Upload the file
         with open(file_to_upload_path, "rb") as file:
-            blob_client.upload_blob(file, overwrite=True)
+            blob_client.upload_blob(file, overwrite=True, max_concurrency=max_concurrency)
         
         # remove the local file
         if remove:
@@ -83,6 +105,54 @@ def upload_file_to_azure(file_to_upload_path: str, blob_name: str, sas_url: str,
        raise Exception(f"Error uploading {blob_name}: {str(e)}")
 
 
+def _read_small_file(file_path: str) -> Optional[bytes]:
+    """Reads a whole file if it fits in a single PUT request.
+
+    Args:
+        file_path (str): The path of the file.
+
+    Returns:
+        Optional[bytes]: The content of the file, or None if it is larger than UPLOAD_SINGLE_PUT_SIZE.
+    """
+    with open(file_path, "rb") as file:
+        data = file.read(UPLOAD_SINGLE_PUT_SIZE + 1)
+    return data if len(data) <= UPLOAD_SINGLE_PUT_SIZE else None
+
+def iter_folder_files(local_folder_path: str) -> Iterator[Tuple[str, str]]:
+    """Lazily yields the files of a folder, recursively, with their blob names relative to the folder.
+
+    Args:
+        local_folder_path (str): The path to the local folder.
+
+    Returns:
+        Iterator[Tuple[str, str]]: The (file path, blob name) pairs.
+    """
+    # Paths are built from the folder path, so the relative path is a plain slice (no os.path.relpath)
+    root_length = len(os.path.join(local_folder_path, ""))
+    # scandir entries cache their type, so no extra stat call is made per file (unlike os.walk + join)
+    folders_to_scan = [local_folder_path]
+    while folders_to_scan:
+        with os.scandir(folders_to_scan.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    folders_to_scan.append(entry.path)
+                elif entry.is_file():
+                    blob_name = entry.path[root_length:]
+                    if os.sep != "/":
+                        blob_name = blob_name.replace(os.sep, "/")  # Normalize for Azure
+                    yield entry.path, blob_name
+
+def list_folder_files(local_folder_path: str) -> List[Tuple[str, str]]:
+    """Lists the files of a folder, recursively, with their blob names relative to the folder.
+
+    Args:
+        local_folder_path (str): The path to the local folder.
+
+    Returns:
+        List[Tuple[str, str]]: The (file path, blob name) pairs.
+    """
+    return list(iter_folder_files(local_folder_path))
+
 def upload_folder_to_azure_parallel(
     local_folder_path: str, output_blob_prefix: str, write_sas_url: str, max_workers=8, remove: bool = False
 ) -> List[str]:
@@ -99,83 +169,146 @@ def upload_folder_to_azure_parallel(
         List[str]: the list of blob names.
     """
     uploaded_files = []
+    blob_names = []
+    futures = []
 
-    # Collect all files to upload
-    files_to_upload = []
-    blob_names =[]
-
-    for root, _, files in os.walk(local_folder_path):
-        for file_name in files:
-            file_path = os.path.join(root, file_name)
-            relative_path = os.path.relpath(file_path, local_folder_path)
-            blob_name = relative_path.replace("\\", "/")  # Normalize for Azure
-            files_to_upload.append((file_path, blob_name))
-            blob_names.append(blob_name)
-
-    # Upload files in parallel
+    # Upload files in parallel. Each file is submitted as soon as it is found, so uploads start while the folder is still walked
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [
-            executor.submit(
+        for file_path, blob_name in iter_folder_files(local_folder_path):
+            blob_names.append(blob_name)
+            futures.append(executor.submit(
                 upload_file_to_azure,
                 file_path,
                 output_blob_prefix + blob_name,
                 write_sas_url,
-                remove
-            )
-            for file_path, blob_name in files_to_upload
-        ]
-
-        for future in futures:
-            result = future.result()
-            if result:
-                uploaded_files.append(result)
-            else:
-                raise Exception(f"Failed to upload {result}")
+                remove,
+                FOLDER_UPLOAD_MAX_CONCURRENCY
+            ))
+
+        # Results are handled as they complete, so the first failure is raised without waiting for earlier submissions
+        for future in as_completed(futures):
+            try:
+                uploaded_files.append(future.result())
+            except Exception:
+                # Fail fast: the uploads not started yet are cancelled instead of run on exiting the executor
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
 
     return blob_names
 
-def upload_blobs_data_to_azure_parallel(
-    blobs_to_upload:List[BlobData], write_sas_url: str, max_workers=8
+async def upload_folder_to_azure_async(
+    local_folder_path: str, output_blob_prefix: str, write_sas_url: str, max_workers: int = 64, remove: bool = False
 ) -> List[str]:
-    """Uploads a list of blobs to Azure Blob Storage in parallel.
+    """Uploads a folder to Azure Blob Storage concurrently on a single event loop.
+
+    Requires the optional "async" dependencies (aiohttp).
 
     Args:
-        blobs_to_upload (List[BlobData]): The list of blobs to upload.
+        local_folder_path (str): The path to the local folder to upload.
+        output_blob_prefix (str): The prefix for the output blobs.
         write_sas_url (str): The SAS URL for the container.
-        max_workers (int, optional): The maximum number of worker threads. Defaults to 8.
+        max_workers (int, optional): The maximum number of files uploaded at the same time. Defaults to 64.
+        remove (bool, optional): Whether to remove the files after upload. Defaults to False.
 
     Returns:
-         List[str]: the list of blob names.
+        List[str]: the list of blob names.
+    """
+    from azure.storage.blob.aio import ContainerClient as AsyncContainerClient
+
+    files_to_upload = list_folder_files(local_folder_path)
+    semaphore = asyncio.Semaphore(max_workers)
+
+    async with AsyncContainerClient.from_container_url(container_url=write_sas_url) as container_client:
+
+        async def upload_single_file(file_path: str, blob_name: str) -> None:
+            blob_client = container_client.get_blob_client(output_blob_prefix + blob_name)
+            async with semaphore:
+                try:
+                    # Small files are read in one blocking call on a worker thread, instead of being read
+                    # from the event loop by the SDK. Larger ones are still streamed from the file
+                    data = await asyncio.to_thread(_read_small_file, file_path)
+                    if data is not None:
+                        await blob_client.upload_blob(data, overwrite=True)
+                    else:
+                        with open(file_path, "rb") as file:
+                            await blob_client.upload_blob(file, overwrite=True)
+                except Exception as e:
+                    raise Exception(f"Error uploading {output_blob_prefix + blob_name}: {str(e)}")
+            if remove:
+                os.remove(file_path)
+
+        await asyncio.gather(*(upload_single_file(file_path, blob_name) for file_path, blob_name in files_to_upload))
+
+    return [blob_name for _, blob_name in files_to_upload]
+
+def upload_folder_to_azure_parallel_async(
+    local_folder_path: str, output_blob_prefix: str, write_sas_url: str, max_workers: int = 64, remove: bool = False
+) -> List[str]:
+    """Synchronous wrapper around upload_folder_to_azure_async. Must not be called from a running event loop.
+
+    Args:
+        local_folder_path (str): The path to the local folder to upload.
+        output_blob_prefix (str): The prefix for the output blobs.
+        write_sas_url (str): The SAS URL for the container.
+        max_workers (int, optional): The maximum number of files uploaded at the same time. Defaults to 64.
+        remove (bool, optional): Whether to remove the files after upload. Defaults to False.
+
+    Returns:
+        List[str]: the list of blob names.
+    """
+    return asyncio.run(upload_folder_to_azure_async(local_folder_path, output_blob_prefix, write_sas_url,
+                                                    max_workers=max_workers, remove=remove))
+
+def _upload_blobs_data_parallel(blobs_to_upload: List[BlobData], write_sas_url: str, max_workers: int = 8) -> Tuple[List[str], List[str]]:
+    """Uploads a list of blobs in parallel. Every blob is attempted, whatever the failures of the others.
+
+    Returns:
+        Tuple[List[str], List[str]]: the names of the uploaded blobs and of the blobs that failed to upload.
     """
     uploaded_blobs = []
     failed_blobs = []
 
-
     # Upload files in parallel
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [
+        futures = {
             executor.submit(
                 upload_data_to_azure,
                 blob_data.data,
                 blob_data.blob_name,
                 write_sas_url
-            )
+            ): blob_data.blob_name
             for blob_data in blobs_to_upload
-        ]
+        }
 
-        for future in futures:
-            result = future.result()
-            if result:
-                uploaded_blobs.append(result)
+        for future in as_completed(futures):
+            if future.result():
+                uploaded_blobs.append(futures[future])
             else:
-                raise Exception(f"Failed to upload {result}")
+                failed_blobs.append(futures[future])
 
-    
+    return uploaded_blobs, failed_blobs
 
-    return [blob.blob_name for blob in blobs_to_upload]
+def upload_blobs_data_to_azure_parallel(
+    blobs_to_upload:List[BlobData], write_sas_url: str, max_workers=8
+) -> List[str]:
+    """Uploads a list of blobs to Azure Blob Storage in parallel.
+
+    Args:
+        blobs_to_upload (List[BlobData]): The list of blobs to upload.
+        write_sas_url (str): The SAS URL for the container.
+        max_workers (int, optional): The maximum number of worker threads. Defaults to 8.
+
+    Raises:
+        Exception: if some blobs could not be uploaded, once all the others were attempted.
 
-SENTINEL = object()
+    Returns:
+         List[str]: the list of blob names.
+    """
+    _, failed_blobs = _upload_blobs_data_parallel(blobs_to_upload, write_sas_url, max_workers)
+    if failed_blobs:
+        raise Exception(f"Failed to upload {len(failed_blobs)} blob(s): {failed_blobs}")
 
+    return [blob.blob_name for blob in blobs_to_upload]
 
 class BlobUploader:
     """A class for uploading blobs to Azure Blob Storage in the background."""
@@ -191,8 +324,16 @@ class BlobUploader:
         self.max_list_len = max_list_len
         self.nb_threads = nb_threads
 
-        self._queue = Queue()
+        self._container_client = get_cached_container_client(sas_url)
+
+        # Bounded so that add_blob blocks (backpressure) when producers outpace the uploads,
+        # while leaving room for manage() to detect a backlog above max_list_len
+        self._queue = Queue(maxsize=max(2 * max_list_len, 8 * nb_threads))
         self._threads: List[Thread] = []
+        # Set to stop all the upload threads at once, without waiting for the queue to be consumed
+        self._stop_event = Event()
+        # Set for good by stop(): no blob can be added afterwards
+        self._closed = Event()
         self._lock = Lock()
         self.nb_uploaded = 0
         self.nb_failed = 0
@@ -211,12 +352,13 @@ class BlobUploader:
 
     def upload_byte_frames(self) -> None:
         """Uploads byte frames from the queue."""
-        while True:
-            blob_data:BlobData = self._queue.get()
-            if blob_data is SENTINEL:
-                break
+        while not self._stop_event.is_set():
+            try:
+                blob_data:BlobData = self._queue.get(timeout=STOP_POLL_INTERVAL)
+            except Empty:
+                continue
             try:
-                if upload_data_to_azure(blob_data.data, blob_data.blob_name, self.sas_url):
+                if upload_data_to_container(blob_data.data, blob_data.blob_name, self._container_client):
                     with self._lock:
                         self.nb_uploaded += 1
                 else:
@@ -232,6 +374,7 @@ class BlobUploader:
             logger.debug("Upload threads already running.")
             return
 
+        self._stop_event.clear()
         self._threads = []
         for i in range(self.nb_threads):
             t = Thread(target=self.upload_byte_frames)
@@ -240,35 +383,52 @@ class BlobUploader:
         logger.debug(f"🚀 Started {self.nb_threads} upload threads.")
 
     def stop_thread_upload(self):
-        """Stops the background upload threads."""
-        for _ in self._threads:
-            self._queue.put(SENTINEL)
+        """Stops the background upload threads, once their current upload is done. Blobs still queued are left in the queue."""
+        self._stop_event.set()
         for t in self._threads:
             t.join()
         logger.debug("🛑 All threads stopped.")
         self._threads = []
 
     def add_blob(self, blob_data: BlobData):
-        """Adds a blob to the upload queue."""
-        self._queue.put(blob_data)
+        """Adds a blob to the upload queue. Blocks while the queue is full.
+
+        Raises:
+            Exception: if the uploader is stopped.
+        """
+        # Wait in short steps, so that a producer blocked on a full queue does not wait forever once the uploader is stopped
+        while not self._closed.is_set():
+            try:
+                self._queue.put(blob_data, timeout=STOP_POLL_INTERVAL)
+                return
+            except Full:
+                continue
+        raise Exception(f"Cannot add {blob_data.blob_name}: the uploader is stopped")
 
     def upload_parallel(self) -> List[str]:
-        """Uploads the remaining blobs in the queue in parallel."""
+        """Uploads the remaining blobs in the queue in parallel. Blobs that fail to upload are counted in nb_failed.
+
+        Returns:
+            List[str]: the names of the uploaded blobs.
+        """
         logger.debug(f"⚡ Switching to parallel upload for {self._queue.qsize()} blobs")
 
-        blobs = []
-        while not self._queue.empty():
-            try:
-                blob = self._queue.get_nowait()
-                if blob is not SENTINEL:
-                    blobs.append(blob)
-            except Empty:
-                break
+        # Drain the whole queue under a single acquisition of its mutex, rather than one get_nowait() per blob
+        with self._queue.mutex:
+            blobs = list(self._queue.queue)
+            self._queue.queue.clear()
+            self._queue.unfinished_tasks = 0
+            # Wake up the producers blocked on the (bounded) queue being full
+            self._queue.not_full.notify_all()
 
-        blob_names = upload_blobs_data_to_azure_parallel(blobs, write_sas_url=self.sas_url)
+        # Like the upload threads, failed blobs are counted instead of raised: the drained blobs are all attempted
+        blob_names, failed_blobs = _upload_blobs_data_parallel(blobs, write_sas_url=self.sas_url)
+        if failed_blobs:
+            logger.error(f"Failed to upload {len(failed_blobs)} blob(s): {failed_blobs}")
 
         with self._lock:
             self.nb_uploaded += len(blob_names)
+            self.nb_failed += len(failed_blobs)
 
         return blob_names
 
@@ -276,14 +436,24 @@ class BlobUploader:
         """Manages the upload queue, switching to parallel upload if the queue gets too long."""
         if self._queue.qsize() > self.max_list_len:
             self.stop_thread_upload()
-            self.upload_parallel()
-            self.start_thread_upload()
+            try:
+                self.upload_parallel()
+            finally:
+                self.start_thread_upload()
 
     def stop(self):
-        """Stops the uploader."""
+        """Stops the uploader, after uploading the blobs still pending."""
+        self._closed.set()
         if not self._queue.empty():
             logger.warning(f"⚠️ Warning: stopping but still {self._queue.qsize()} pending")
-        self.stop_thread_upload()
+        try:
+            # The upload threads keep consuming the queue while the remaining blobs are uploaded in parallel
+            if not self._queue.empty():
+                self.upload_parallel()
+        finally:
+            self.stop_thread_upload()
+            if not self._queue.empty():
+                logger.warning(f"⚠️ Warning: {self._queue.qsize()} blobs added while stopping were not uploaded")
    
         
         
\ No newline at end of file
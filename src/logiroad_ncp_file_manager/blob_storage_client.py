@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import Self
+from typing import Iterable, Self
 from .settings import *
 
 class BlobStorageClient(ABC):
@@ -59,6 +59,20 @@ class BlobStorageClient(ABC):
     @abstractmethod
     def get_blob_size(self, container_name:str,blob_name:str)->int:
         pass
+
+    @abstractmethod
+    def get_blob_sizes(self, container_name:str, prefix:str)->dict[str, int]:
+        """
+        Get the sizes of all blobs starting with the given prefix, from a single listing.
+
+        Args:
+            container_name (str): The name of the container
+            prefix (str): The prefix to filter blobs by
+
+        Returns:
+            dict[str, int]: The size in bytes of each blob, by blob name
+        """
+        pass
     
     @abstractmethod
     def list_blob_download_urls(self, container_name:str, prefix:str)->list[str]:
@@ -115,3 +129,18 @@ class BlobStorageClient(ABC):
             access_tier (str): The new access tier to set for the blob.
         """
         pass
+
+    @abstractmethod
+    def change_blob_access_tiers(self, container_name: str, blob_names: Iterable[str], access_tier: str) -> int:
+        """
+        Change the access tier of several blobs in the specified container.
+
+        Args:
+            container_name (str): The name of the container.
+            blob_names (Iterable[str]): The names of the blobs.
+            access_tier (str): The new access tier to set for the blobs.
+
+        Returns:
+            int: The number of blobs whose access tier was changed.
+        """
+        pass
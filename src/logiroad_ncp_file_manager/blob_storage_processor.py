@@ -2,6 +2,9 @@ from abc import ABC
 from .blob_storage_structure import BlobStorageStructure, ContainerBase
 from .blob_storage_client import BlobStorageClient
 
+_READ_ONLY_PERMISSIONS = dict(read=True, list=True, write=False, create=False, delete=False)
+_READ_WRITE_PERMISSIONS = dict(read=True, list=True, write=True, create=True, delete=True)
+
 class BlobStorageProcessor(ABC):
     blob_storage_structure:BlobStorageStructure
     blob_storage_client: BlobStorageClient
@@ -17,10 +20,12 @@ class BlobStorageProcessor(ABC):
             self.blob_storage_structure.container_processed]
         
         permissions = [raw_permission,extracted_permission,processed_permission]
+        # Containers sharing the same name and permission share the same SAS URL, signed only once
+        sas_urls:dict[tuple[str, bool], str] = {}
         for container,p in zip(containers,permissions): 
-            if p == "w":
-                sas_url = self.blob_storage_client.generate_url_with_permissions(container_name=container.name,read=True,list = True,write=True, create=True, delete=True)
-            else:
-                sas_url = self.blob_storage_client.generate_url_with_permissions(container_name=container.name,read=True,list = True,write=False, create=False, delete=False)
-            container.sas_url =sas_url
+            key = (container.name, p == "w")
+            if key not in sas_urls:
+                permission_kwargs = _READ_WRITE_PERMISSIONS if p == "w" else _READ_ONLY_PERMISSIONS
+                sas_urls[key] = self.blob_storage_client.generate_url_with_permissions(container_name=container.name, **permission_kwargs)
+            container.sas_url = sas_urls[key]
 
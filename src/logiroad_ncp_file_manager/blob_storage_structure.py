@@ -1,3 +1,4 @@
+import functools
 import json
 import logging
 import os
@@ -5,7 +6,7 @@ import re
 
 from datetime import datetime
 from pathlib import Path
-from typing import List, Self
+from typing import Self, Tuple
 from pydantic import BaseModel, Field
 
 from .const import ContainerTypeEnum, L2R_ResultFile, NCP_ResultFile
@@ -14,6 +15,18 @@ from .settings import *
 
 logger = logging.getLogger(__name__)
 
+_L2R_TIMESTAMP_RE = re.compile(r"^(\d{8}_\d{6})")
+_PLACEHOLDER_RE = re.compile(r"\{(\w+)\}")
+
+def _fill_template(template: str, **values: str) -> str:
+    """
+    Replaces the {placeholders} of a template with the given values, in a single pass over the template.
+    Placeholders without a value are kept as is. A value set to None raises a TypeError (e.g. a record without network slug).
+    """
+    missing_values = [key for key, value in values.items() if value is None]
+    if missing_values:
+        raise TypeError(f"Template values must be strings, got None for: {', '.join(missing_values)}")
+    return _PLACEHOLDER_RE.sub(lambda match: values.get(match.group(1), match.group(0)), template)
 
 def _get_l2r_timestamp_prefix(gps_device_name: str) -> str:
     """
@@ -22,7 +35,7 @@ def _get_l2r_timestamp_prefix(gps_device_name: str) -> str:
     
     Example: "20230101_120000_device.gps" -> "20230101_120000"
     """
-    match = re.match(r"^(\d{8}_\d{6})", gps_device_name)
+    match = _L2R_TIMESTAMP_RE.match(gps_device_name)
     if match:
         return match.group(1)
     
@@ -33,6 +46,44 @@ def _get_l2r_timestamp_prefix(gps_device_name: str) -> str:
     return datetime.now().strftime("%Y%m%d_%H%M%S")
 
 
+@functools.lru_cache(maxsize=8)
+def _load_template(json_path: str) -> str:
+    """
+    Reads a blob storage structure template, relative to this module, with the container names filled in.
+    The result is cached: the file is read once, and AZURE_CONTAINERS does not change after import.
+    """
+    template_path = os.path.join(os.path.dirname(__file__), json_path)
+    with open(template_path) as json_data:
+        json_data=json_data.read()
+    containers = AZURE_CONTAINERS
+    return _fill_template(
+        json_data,
+        container_raw_name=containers.get("raw"),
+        container_extracted_name=containers.get("extracted"),
+        container_processed_name=containers.get("processed")
+    )
+
+@functools.lru_cache(maxsize=8)
+def _load_template_dict(json_path: str) -> dict:
+    """
+    Parses a blob storage structure template (see _load_template).
+    It is validated once here, so structures built from it can skip validation.
+    """
+    template = json.loads(_load_template(json_path))
+    BlobStorageStructure.model_validate(template)
+    return template
+
+def _fill_template_values(value, values: dict):
+    """Returns a copy of a parsed template value, with the {placeholders} of its strings filled (see _fill_template)."""
+    if isinstance(value, str):
+        return _fill_template(value, **values)
+    if isinstance(value, dict):
+        return {key: _fill_template_values(item, values) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_fill_template_values(item, values) for item in value]
+    return value
+
+
 class L2R_ResultFileNameManager:
     custom_l2r_result_path:str
     custom_l2r_trajectory_path:str
@@ -42,15 +93,16 @@ class L2R_ResultFileNameManager:
         self.custom_l2r_result_path = f"{timestamp_prefix}_l2r_result.json"
         self.custom_l2r_trajectory_path = f'{Path(gps_reader_name).stem}_l2r_trajectory.csv'
         self.custom_l2r_vpng_path = 'l2r_vpng.vpng'
+        self._paths:dict[L2R_ResultFile, str] = {
+            L2R_ResultFile.L2R_RESULT: self.custom_l2r_result_path,
+            L2R_ResultFile.L2R_TRAJECTORY: self.custom_l2r_trajectory_path,
+            L2R_ResultFile.L2R_VPNG: self.custom_l2r_vpng_path,
+        }
     
     def get_path(self,l2r_result_file:L2R_ResultFile)->str:
-        if l2r_result_file == L2R_ResultFile.L2R_RESULT:
-            return self.custom_l2r_result_path
-        elif l2r_result_file == L2R_ResultFile.L2R_TRAJECTORY:
-            return self.custom_l2r_trajectory_path
-        elif l2r_result_file == L2R_ResultFile.L2R_VPNG:
-            return self.custom_l2r_vpng_path
-        else:
+        try:
+            return self._paths[l2r_result_file]
+        except KeyError:
             raise ValueError(f"Not implemented L2R result file: {l2r_result_file}")
 
 class ContainerBase(BaseModel):
@@ -85,6 +137,18 @@ class ContainerProcessed(ContainerExtracted):
     """Model for the processed container configuration."""
     equirect_prefix:str
 
+_CONTAINER_ATTRIBUTES:dict[ContainerTypeEnum, str] = {
+    ContainerTypeEnum.RAW: "container_raw",
+    ContainerTypeEnum.EXTRACTED: "container_extracted",
+    ContainerTypeEnum.PROCESSED: "container_processed",
+}
+
+_CONTAINER_MODELS:dict[str, type[ContainerBase]] = {
+    "container_raw": ContainerRaw,
+    "container_extracted": ContainerExtracted,
+    "container_processed": ContainerProcessed,
+}
+
 class BlobStorageStructure(BaseModel):
     """Model for the Cloud structure configuration."""
     calibration_video:str
@@ -98,8 +162,9 @@ class BlobStorageStructure(BaseModel):
     }
 
     @property
-    def containers(self)->List[ContainerBase]:
-        return [self.container_raw, self.container_extracted, self.container_processed]
+    def containers(self)->Tuple[ContainerBase, ...]:
+        # Not cached: the containers can be reassigned on the (mutable) model, or replaced by model_copy
+        return (self.container_raw, self.container_extracted, self.container_processed)
         
     def to_dict(self)->dict:
         """Converts the model to a dictionary."""
@@ -107,17 +172,15 @@ class BlobStorageStructure(BaseModel):
     
     def to_json(self):
         """Converts the model to a JSON string."""
-        return json.dumps(self.model_dump(), indent=4)
+        # Serialized by pydantic-core, without building an intermediate dict
+        return self.model_dump_json(indent=4)
     
     def get_container(self,container_type:ContainerTypeEnum)->ContainerRaw:
-        if container_type == ContainerTypeEnum.RAW:
-            return self.container_raw
-        elif container_type == ContainerTypeEnum.EXTRACTED:
-            return self.container_extracted
-        elif container_type == ContainerTypeEnum.PROCESSED:
-            return self.container_processed
-        else:
+        # The attribute is resolved on each call: containers can be reassigned on the (mutable) model
+        container_attribute = _CONTAINER_ATTRIBUTES.get(container_type)
+        if container_attribute is None:
             raise ValueError(f"Invalid container type: {container_type}")
+        return getattr(self, container_attribute)
     
     def get_NCP_result_blob(self,container_type:ContainerTypeEnum,ncp_result:NCP_ResultFile)->str:
         if container_type == ContainerTypeEnum.RAW:
@@ -131,7 +194,10 @@ class BlobStorageStructure(BaseModel):
     def get_cloud_blob_path_with_record_prefix(self,blob_name:str)->str:
         if self.record_prefix is None:
             raise ValueError(f"record prefix not set yet")
-        return os.path.join(self.record_prefix, blob_name)
+        # Blob names always use "/", whatever the local OS separator
+        if not self.record_prefix or self.record_prefix.endswith("/"):
+            return f"{self.record_prefix}{blob_name}"
+        return f"{self.record_prefix}/{blob_name}"
     
     def get_frame_directory_prefix(self,container_type:ContainerTypeEnum)->str:
         """
@@ -168,83 +234,32 @@ class BlobStorageStructure(BaseModel):
             raise TypeError(f"Input must be a JSON string or a dictionary, not {type(data_input)}")
     
     @classmethod
-    def from_json_file(cls, json_path:str=default_blob_storage_structure_template_path)->Self:
-        template_path = os.path.join(os.path.dirname(__file__), json_path)
-        with open(template_path) as json_data:
-            json_data=json_data.read()
-            containers:dict = AZURE_CONTAINERS
-
-            json_data = json_data.replace('{container_raw_name}',containers.get("raw"))
-            json_data = json_data.replace('{container_extracted_name}',containers.get("extracted"))
-            json_data = json_data.replace('{container_processed_name}',containers.get("processed"))
+    def _from_template(cls, json_path:str, **values:str)->Self:
+        """
+        Creates a model instance from a template, with its {placeholders} filled with the given values.
+        The template was validated when loaded, so the models are built without validation (model_construct).
+        """
+        data = _fill_template_values(_load_template_dict(json_path), values)
+        for container_attribute, container_model in _CONTAINER_MODELS.items():
+            data[container_attribute] = container_model.model_construct(**data[container_attribute])
+        return cls.model_construct(**data)
 
-            return cls.from_input(json_data)
+    @classmethod
+    def from_json_file(cls, json_path:str=default_blob_storage_structure_template_path)->Self:
+        return cls._from_template(json_path)
     
     @classmethod
     def from_record(cls,record:Record, json_path=default_blob_storage_structure_template_path)->Self:
-        template_path = os.path.join(os.path.dirname(__file__), json_path)
-
-        with open(template_path) as json_data:
-            json_data=json_data.read().replace(
-            '{network_slot}', record.network_slug
-            ).replace(
-                '{record_slot}', record.slot
-            )
-            containers:dict = AZURE_CONTAINERS
-            json_data = json_data.replace('{container_raw_name}',containers.get("raw"))
-            json_data = json_data.replace('{container_extracted_name}',containers.get("extracted"))
-            json_data = json_data.replace('{container_processed_name}',containers.get("processed"))
-
-            return cls.from_input(json_data)
+        return cls._from_template(json_path, network_slot=record.network_slug, record_slot=record.slot)
 
     @classmethod
     def from_camera(cls,camera:Camera, json_path=default_blob_storage_structure_template_path)->Self:
-        template_path = os.path.join(os.path.dirname(__file__), json_path)
-
-        with open(template_path) as json_data:
-            json_data=json_data.read().replace(
-            '{camera_id}', camera.unique_id
-            )
-            containers:dict = AZURE_CONTAINERS
-
-            json_data = json_data.replace('{container_raw_name}',containers.get("raw"))
-            json_data = json_data.replace('{container_extracted_name}',containers.get("extracted"))
-            json_data = json_data.replace('{container_processed_name}',containers.get("processed"))
-            return cls.from_input(json_data)
+        return cls._from_template(json_path, camera_id=camera.unique_id)
 
     @classmethod
     def from_calibration_video(cls,calibrationVideo:CalibrationVideo, json_path=default_blob_storage_structure_template_path)->Self:
-        template_path = os.path.join(os.path.dirname(__file__), json_path)
-
-        with open(template_path) as json_data:
-            json_data=json_data.read().replace(
-            '{camera_id}', calibrationVideo.camera.unique_id
-            ).replace(
-            '{video_blob}', calibrationVideo.title
-            )
-
-            containers:dict = AZURE_CONTAINERS
+        return cls._from_template(json_path, camera_id=calibrationVideo.camera.unique_id, video_blob=calibrationVideo.title)
 
-            json_data = json_data.replace('{container_raw_name}',containers.get("raw"))
-            json_data = json_data.replace('{container_extracted_name}',containers.get("extracted"))
-            json_data = json_data.replace('{container_processed_name}',containers.get("processed"))
-            return cls.from_input(json_data)
-
-    def to_dict(self):
-        # Convert the instance back to a dictionary
-        return {
-            "calibration_video": self.calibration_video,
-            "network_prefix": self.network_prefix,
-            "record_prefix": self.record_prefix,
-            "container_raw": self.container_raw.to_dict(),
-            "container_extracted": self.container_extracted.to_dict(),
-            "container_processed": self.container_processed.to_dict()
-        }
-
-    def to_json(self):
-        # Convert the instance to a JSON string
-        return json.dumps(self.to_dict(), indent=4)
-    
     def get_network_path(self, network_slot:str)->str:
         """Get the container for a network"""
         return self.network_prefix.format(network_slot=network_slot)
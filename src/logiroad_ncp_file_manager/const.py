@@ -18,4 +18,5 @@ class L2R_ResultFile(Enum):
     L2R_RESULT="l2r_result"
     L2R_VPNG = "l2r_vpng"
 
-allowed_image_extensions = ['.png','.jpg','.jpeg']
\ No newline at end of file
+# Tuple so a name can be checked against every extension in one call: name.lower().endswith(allowed_image_extensions)
+allowed_image_extensions = ('.png', '.jpg', '.jpeg')
@@ -1,64 +1,68 @@
 from enum import Enum
 import os
-from typing import Tuple
+import re
+from typing import Optional, Tuple
 
 class ImageType(Enum):
     CUBEMAP = "cubemap"
     EQUIRECT = "equirect"
     STANDARD = "photo"
 
+# Plain dict lookup, cheaper than the Enum.value descriptor in per-image loops
+IMAGE_TYPE_VALUES = {image_type: image_type.value for image_type in ImageType}
+
 prefix_splitter = "_f_"
 anonymized_suffix = "_anonymized"
 image_extension = "jpg"
 
+# [prefix_f_]<frame index>_<image type>[...], parsed in a single scan. The prefix ends at the first "_f_" followed by a frame index
+_IMAGE_NAME_RE = re.compile(rf"^(?:(?P<prefix>.*?){prefix_splitter})?(?P<frame_index>\d+)_(?P<image_type>[^_.]*)")
+
 
 def name_image(frame_index: int, img_type: ImageType, is_anonymized: bool, prefix="") -> str:
-    img_name = f"{frame_index}_{img_type.value}"
-    if prefix:
-        img_name = f"{prefix}{prefix_splitter}{img_name}"
-    if is_anonymized:
-        img_name += anonymized_suffix
-    img_name += f".{image_extension}"
-    return img_name
+    prefix_part = f"{prefix}{prefix_splitter}" if prefix else ""
+    anonymized_part = anonymized_suffix if is_anonymized else ""
+    return f"{prefix_part}{frame_index}_{IMAGE_TYPE_VALUES[img_type]}{anonymized_part}.{image_extension}"
 
-def rename_image(image_name: str, img_type: ImageType, is_anonymized: bool,prefix="") -> str:
-    frame_name_prefix_split = image_name.split(prefix_splitter)
-    if frame_name_prefix_split:
-        prefix = frame_name_prefix_split[0]#if there is already a prefix, we keep it and ignore the one that is passed
-        image_name = frame_name_prefix_split[1]
-    try:
-        frame_index = int(image_name.split('_')[0])  # Ensure frame_index is an integer
-    except ValueError:
+def _base_name(path: str) -> str:
+    """Same as os.path.basename, with one C-level scan per separator."""
+    base_name = path.rpartition("/")[2]
+    if os.sep != "/":
+        base_name = base_name.rpartition(os.sep)[2]
+    return base_name
+
+def _parse_image_name(image_name: str) -> re.Match:
+    match = _IMAGE_NAME_RE.match(image_name)
+    if match is None:
         raise ValueError(f"Invalid image name format: {image_name}")
+    return match
+
+def _split_frame_index(image_name: str) -> Tuple[Optional[str], int]:
+    """Returns the prefix (None if there is none) and the frame index of an image name."""
+    # Fast path for unprefixed names: the frame index is everything before the first "_"
+    head, separator, _ = image_name.partition("_")
+    if separator and head.isdecimal() and prefix_splitter not in image_name:
+        return None, int(head)
+    match = _parse_image_name(image_name)
+    return match["prefix"], int(match["frame_index"])
 
+def rename_image(image_name: str, img_type: ImageType, is_anonymized: bool,prefix="") -> str:
+    image_prefix, frame_index = _split_frame_index(image_name)
+    if image_prefix is not None:
+        prefix = image_prefix#if there is already a prefix, we keep it and ignore the one that is passed
     img_name = name_image(frame_index, img_type, is_anonymized,prefix)
     return img_name
 
 def get_frame_index_from_image_name(input_image_name: str) -> int:
-    base_name = os.path.basename(input_image_name)
-    frame_name_prefix_split = base_name.split(prefix_splitter)
-    if frame_name_prefix_split:
-        image_name = frame_name_prefix_split[1]
-    try:
-        frame_index = int(image_name.split('_')[0])  # Ensure frame_index is an integer
-    except ValueError:
-        raise ValueError(f"Invalid image name format: {input_image_name}")
-    return frame_index
+    return _split_frame_index(_base_name(input_image_name))[1]
 
 def extract_name_structure(input_image_name:str)->Tuple[str,ImageType,bool]:
-    #keep only basename
-    base_name = os.path.basename(input_image_name)
-    #remove extension if needed
-    file_name_no_extension, extension = os.path.splitext(base_name)
-    frame_name_prefix_split = file_name_no_extension.split(prefix_splitter)
-    prefix=""
-    if frame_name_prefix_split:
-        image_name = frame_name_prefix_split[1]
-        prefix = frame_name_prefix_split[0]
-    splitted = image_name.split('_')
-    image_type = ImageType(splitted[1])
-    is_anonymized = anonymized_suffix in image_name
-    return prefix,image_type,is_anonymized
+    #keep only basename, the extension is not part of the image type
+    base_name = _base_name(input_image_name)
+    match = _parse_image_name(base_name)
+    image_type = ImageType(match["image_type"])
+    is_anonymized = anonymized_suffix in base_name[match.start("frame_index"):]
+    return match["prefix"] or "",image_type,is_anonymized
 
 def set_image_name_as_type(image_name:str, type:ImageType)->str:
     is_anonymized = anonymized_suffix in image_name
@@ -68,5 +72,10 @@ def set_image_name_as_type(image_name:str, type:ImageType)->str:
 def set_image_name_as_anonymized(image_name: str) -> str:
     if anonymized_suffix in image_name:
         return image_name
-    name, ext = os.path.splitext(image_name)
-    return f"{name}{anonymized_suffix}{ext}"
\ No newline at end of file
+    # Same split as os.path.splitext: the extension starts at the last dot of the base name, unless only dots precede it
+    dot = image_name.rfind(".")
+    # Like _base_name, the base name starts after the last "/" or os.sep ("\\" on Windows)
+    base_name_start = max(image_name.rfind("/"), image_name.rfind(os.sep)) + 1
+    if dot < base_name_start or not image_name[base_name_start:dot].lstrip("."):
+        return image_name + anonymized_suffix
+    return f"{image_name[:dot]}{anonymized_suffix}{image_name[dot:]}"
\ No newline at end of file
@@ -1,19 +1,19 @@
 from dataclasses import dataclass
 from typing import Any, List, Optional
 
-@dataclass
+@dataclass(slots=True)
 class NCPModel:
     id: int
 
-@dataclass
+@dataclass(slots=True)
 class Network(NCPModel):
     network_slot: str
 
-@dataclass
+@dataclass(slots=True)
 class Camera(NCPModel):
     unique_id:str
 
-@dataclass
+@dataclass(slots=True)
 class Record(NCPModel):
     unique_id:Optional[str] = None
     network_uuid:Optional[str] = None
@@ -23,7 +23,7 @@ class Record(NCPModel):
     srid:Optional[int] = None
     slot:Optional[str] = None
  
-@dataclass   
+@dataclass(slots=True)
 class CalibrationVideo(NCPModel):    
     camera: Camera
     title:str
@@ -1,8 +1,10 @@
 import logging
 import os
+import posixpath
 import shutil
 from abc import ABC, abstractmethod
-from typing import Dict, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 
 from .models import Record
 from .const import ContainerTypeEnum,L2R_ResultFile, NCP_ResultFile
@@ -12,12 +14,92 @@ from .blob_storage_client import BlobStorageClient
 logger = logging.getLogger(__name__)
 
 tmp_dir = "tmp"
+# unlink is a blocking syscall that releases the GIL: a few threads hide its latency on large trees
+RMTREE_MAX_WORKERS = 16
+# Smaller trees are not worth a thread
+RMTREE_FILES_PER_WORKER = 256
+
+# Absolute paths of the temp dirs already created by get_temp_dir in this process
+_created_temp_dirs = set()
 
 def get_temp_dir(instanceId: str):
     base_dir = os.path.join(tmp_dir, f"gopro_{instanceId}")
-    os.makedirs(base_dir, exist_ok=True)
+    # Keyed by absolute path, as tmp_dir is relative to the working directory
+    absolute_base_dir = os.path.abspath(base_dir)
+    if absolute_base_dir not in _created_temp_dirs:
+        os.makedirs(base_dir, exist_ok=True)
+        _created_temp_dirs.add(absolute_base_dir)
     return base_dir
 
+def _make_dirs(paths:List[str])->None:
+    """Creates the given directories and their missing parents.
+
+    Parents are created before their children, so a directory whose parent was just created
+    is made with a single os.mkdir instead of a full os.makedirs stat chain.
+
+    Args:
+        paths (List[str]): The directories to create.
+    """
+    created = set()
+    for path in sorted({os.path.normpath(path) for path in paths}, key=len):
+        if os.path.dirname(path) in created:
+            try:
+                os.mkdir(path)
+            except FileExistsError:
+                if not os.path.isdir(path):
+                    raise
+        else:
+            os.makedirs(path, exist_ok=True)
+        created.add(path)
+
+def _unlink_quietly(paths:List[str])->None:
+    for path in paths:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+def _fast_rmtree(path:str)->None:
+    """Removes a directory tree, unlinking its files in parallel. Errors are ignored, like shutil.rmtree(ignore_errors=True).
+
+    Args:
+        path (str): The directory to remove.
+    """
+    if os.path.islink(path) or not os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+        return
+    files = []
+    dirs = []
+    stack = [path]
+    while stack:
+        directory = stack.pop()
+        dirs.append(directory)
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    else:
+                        files.append(entry.path)
+        except OSError:
+            pass
+    nb_workers = min(RMTREE_MAX_WORKERS, len(files) // RMTREE_FILES_PER_WORKER + 1)
+    if nb_workers == 1:
+        _unlink_quietly(files)
+    else:
+        # One slice of the files per thread, rather than one task per file
+        with ThreadPoolExecutor(max_workers=nb_workers) as executor:
+            executor.map(_unlink_quietly, [files[i::nb_workers] for i in range(nb_workers)])
+    # A directory is always listed before its subdirectories: remove them in reverse order
+    for directory in reversed(dirs):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            pass
+    if os.path.lexists(path):
+        # Whatever could not be removed above (e.g. files created meanwhile)
+        shutil.rmtree(path, ignore_errors=True)
+
 class NCPFileManager(ABC):
     """Manages Cloud blob storage operations for a given record."""
     blobStorageStructure:BlobStorageStructure
@@ -28,7 +110,7 @@ class NCPFileManager(ABC):
     downloaded_ncp_results:Dict[NCP_ResultFile,str]
     processed_ncp_results:Dict[NCP_ResultFile,str]
     processed_l2r_results:Dict[L2R_ResultFile,str]
-    l2r_results_blob_names:Dict[L2R_ResultFile,str]
+    _l2r_results_blob_names:Optional[Dict[L2R_ResultFile,str]] = None
     downloaded_frame_dir = ""
     downloaded_equirect_dir = ""
     record_prefix = ""
@@ -68,25 +150,32 @@ class NCPFileManager(ABC):
         self.processed_ncp_results = {}
         self.processed_l2r_results = {}
         self.downloaded_ncp_results = {}
-        self.l2r_results_blob_names = {}
         container_extracted = blob_storage_structure.container_extracted
         if container_extracted:
-            for result_file in NCP_ResultFile:
-                self.processed_ncp_results[result_file] = os.path.join(self.input_dir, container_extracted.ncp_result_blobs[result_file.value])
-            for result_file in L2R_ResultFile:
-                self.processed_l2r_results[result_file] = os.path.join(self.input_dir, container_extracted.l2r_result_blobs[result_file.value])
+            # Local paths: os.path.join, unlike blob names
+            input_dir = self.input_dir
+            ncp_result_blobs = container_extracted.ncp_result_blobs
+            l2r_result_blobs = container_extracted.l2r_result_blobs
+            self.processed_ncp_results = {result_file: os.path.join(input_dir, ncp_result_blobs[result_file.value]) for result_file in NCP_ResultFile}
+            self.processed_l2r_results = {result_file: os.path.join(input_dir, l2r_result_blobs[result_file.value]) for result_file in L2R_ResultFile}
         
         #let's create necessary folders
-        dirs = [self.tmp_dir, self.input_dir, self.output_dir, self.downloaded_frame_dir, self.downloaded_equirect_dir, self.processed_frame_dir, self.processed_equirect_dir]
-        for dir in dirs:
-            os.makedirs(dir, exist_ok=True)
-        
-        self.set_L2R_blob_names(gps_reader_name="")
+        _make_dirs([self.tmp_dir, self.input_dir, self.output_dir, self.downloaded_frame_dir, self.downloaded_equirect_dir, self.processed_frame_dir, self.processed_equirect_dir])
+
+    @property
+    def l2r_results_blob_names(self)->Dict[L2R_ResultFile,str]:
+        # The default names (no gps reader) are only built for managers that use L2R results
+        if self._l2r_results_blob_names is None:
+            self.set_L2R_blob_names(gps_reader_name="")
+        return self._l2r_results_blob_names
+
+    @l2r_results_blob_names.setter
+    def l2r_results_blob_names(self, l2r_results_blob_names:Dict[L2R_ResultFile,str]):
+        self._l2r_results_blob_names = l2r_results_blob_names
 
     def set_L2R_blob_names(self,gps_reader_name:str):
        l2r_result_name_manager= L2R_ResultFileNameManager(gps_reader_name=gps_reader_name)
-       for r in L2R_ResultFile:
-           self.l2r_results_blob_names[r] = l2r_result_name_manager.get_path(l2r_result_file=r)
+       self._l2r_results_blob_names = {r: l2r_result_name_manager.get_path(l2r_result_file=r) for r in L2R_ResultFile}
     
     @classmethod
     def from_blob_storage_structure(cls, blob_storage_structure_json:Dict | str | BlobStorageStructure , instance_id:str, use_record_dir=True):
@@ -108,7 +197,9 @@ class NCPFileManager(ABC):
     def clean(self)->None:
         """Cleans the temporary directory."""
         logging.debug("cleaning tmp dir")
-        shutil.rmtree(self.tmp_dir,ignore_errors=True)
+        _fast_rmtree(self.tmp_dir)
+        # Without the record dir, tmp_dir is the temp dir itself: get_temp_dir must create it again
+        _created_temp_dirs.discard(os.path.abspath(self.tmp_dir))
 
     def remove_record_prefix(self, path:str)->str:
         """Removes the record prefix from a given path.
@@ -120,7 +211,7 @@ class NCPFileManager(ABC):
             str: The path without the record prefix.
         """
         prefix=self.record_prefix
-        if prefix !="" and prefix in path:
+        if prefix and path.startswith(prefix):
             return path[len(prefix):]
         return path
     
@@ -141,7 +232,7 @@ class NCPFileManager(ABC):
         pass
     
     @abstractmethod
-    def download_blobs_in_parallel(self, container_type:ContainerTypeEnum, blob_names:List[str], download_directory:str="",max_workers: int = 4, max_concurrency: int = 4, prefix_to_remove:str="")-> List[str]:
+    def download_blobs_in_parallel(self, container_type:ContainerTypeEnum, blob_names:List[str], download_directory:str="",max_workers: Optional[int] = None, max_concurrency: int = 4, prefix_to_remove:str="")-> List[str]:
         """Downloads a list of blobs in parallel from the specified container.
         
         Args:
@@ -278,6 +369,28 @@ class NCPFileManager(ABC):
         downloaded_paths= self._download_blobs_with_prefix_parallel(container_type, equirect_prefix, self.downloaded_equirect_dir)
         return downloaded_paths
     
+    def download_all(self, container_type:ContainerTypeEnum, ncp_results:List[NCP_ResultFile], include_frames:bool=True, include_equirects:bool=False)->Tuple[Dict[NCP_ResultFile,str], List[str], List[str]]:
+        """Downloads NCP result files, frames and equirectangular frames from the specified container at the same time.
+        
+        Args:
+            container_type (ContainerTypeEnum): The type of container to download from.
+            ncp_results (List[NCP_ResultFile]): The NCP result files to download.
+            include_frames (bool, optional): Whether to download the frames. Defaults to True.
+            include_equirects (bool, optional): Whether to download the equirectangular frames (processed container only). Defaults to False.
+            
+        Returns:
+            Tuple[Dict[NCP_ResultFile,str], List[str], List[str]]: the paths of the NCP result files, of the frames and of the equirectangular frames.
+        """
+        # Each workload starts with its own round trips: running them together avoids waiting for the tail of the previous one
+        with ThreadPoolExecutor(max_workers=len(ncp_results) + 2) as executor:
+            ncp_futures = {result_file: executor.submit(self.download_ncp_result_file, container_type, result_file) for result_file in ncp_results}
+            frames_future = executor.submit(self.download_frames, container_type) if include_frames else None
+            equirects_future = executor.submit(self.download_equirects, container_type) if include_equirects else None
+            ncp_paths = {result_file: future.result() for result_file, future in ncp_futures.items()}
+            frame_paths = frames_future.result() if frames_future else []
+            equirect_paths = equirects_future.result() if equirects_future else []
+        return ncp_paths, frame_paths, equirect_paths
+
     def upload_downloaded_ncp_result_file(self, container_type:ContainerTypeEnum, ncp_result:NCP_ResultFile)-> str:
         """Uploads the downloaded result file to the specified container.
 
@@ -369,9 +482,8 @@ class NCPFileManager(ABC):
         Returns:
             List[str]: list of uploaded blob names.
         """
-        blobStorageStructure: BlobStorageStructure = self.blobStorageStructure
-        equirect_prefix =blobStorageStructure.get_equirect_directory_prefix(container_type)
-        return self.upload_record_folder_to_cloud_parallel.json(container_type, self.downloaded_equirect_dir, equirect_prefix)
+        equirect_prefix = self.blobStorageStructure.get_equirect_directory_prefix(container_type)
+        return self.upload_record_folder_to_cloud_parallel(container_type, self.downloaded_equirect_dir, equirect_prefix)
     
     def upload_processed_equirects(self, container_type:ContainerTypeEnum,extra_prefix="")-> List[str]:
         """Uploads the processed equirectangular frames to the specified container.
@@ -385,7 +497,7 @@ class NCPFileManager(ABC):
         """
         blobStorageStructure: BlobStorageStructure = self.blobStorageStructure
         equirect_prefix = blobStorageStructure.get_equirect_directory_prefix(container_type)
-        equirect_prefix = os.path.join(extra_prefix, equirect_prefix)
+        equirect_prefix = posixpath.join(extra_prefix, equirect_prefix)
         return self.upload_record_folder_to_cloud_parallel(container_type, self.processed_equirect_dir, equirect_prefix)
 
     @abstractmethod
@@ -395,7 +507,7 @@ class NCPFileManager(ABC):
         Args:
             container_type (ContainerTypeEnum): The type of container to list from.
             prefix (str, optional): The prefix to filter the blobs with. Defaults to "".
-            extensions (List[str], optional): The list of extensions to filter the blobs with. Defaults to [].
+            extensions (List[str], optional): The list of extensions to filter the blobs with. Defaults to [], which keeps all blobs.
             
         Returns:
             List[str]: A list of blob names.
@@ -439,7 +551,7 @@ class NCPFileManager(ABC):
         """
         pass
     
-    def delete_all_files_in_container_for_record(self, container_type:ContainerTypeEnum, record:Record, blob_storage_structure:BlobStorageStructure=None)->bool:
+    def delete_all_files_in_container_for_record(self, container_type:ContainerTypeEnum, record:Record, blob_storage_structure:BlobStorageStructure=None)->None:
         if blob_storage_structure is None:
             blob_storage_structure = BlobStorageStructure.from_record(record=record)
         
@@ -451,9 +563,15 @@ class NCPFileManager(ABC):
         container_name = blob_storage_structure.get_container(container_type).name
         self.blobStorageClient.delete_blobs_by_prefix(container_name=container_name, prefix=record_prefix)
 
-    def delete_all_files_in_all_containers_for_record(self, record:Record)->bool:
-        for container_type in ContainerTypeEnum:
-            self.delete_all_files_in_container_for_record(container_type=container_type, record=record)
+    def delete_all_files_in_all_containers_for_record(self, record:Record)->None:
+        blob_storage_structure = BlobStorageStructure.from_record(record=record)
+        # The containers are independent: their batch deletions run at the same time
+        with ThreadPoolExecutor(max_workers=len(ContainerTypeEnum)) as executor:
+            # Consuming the results re-raises the first exception of a container
+            list(executor.map(
+                lambda container_type: self.delete_all_files_in_container_for_record(container_type=container_type, record=record, blob_storage_structure=blob_storage_structure),
+                ContainerTypeEnum
+            ))
     
     def delete_all_files_in_container(self,container_type: ContainerTypeEnum) -> int:
         """
@@ -466,17 +584,8 @@ class NCPFileManager(ABC):
         """
         
         record_prefix = self.blobStorageStructure.record_prefix
-        container: ContainerBase = None
-
-        if container_type == ContainerTypeEnum.RAW:
-            container = self.blobStorageStructure.container_raw
-        elif container_type == ContainerTypeEnum.EXTRACTED:
-            container = self.blobStorageStructure.container_extracted
-        elif container_type == ContainerTypeEnum.PROCESSED:
-            container = self.blobStorageStructure.container_processed
-        else:
-            # Should not happen if ContainerTypeEnum is used correctly
-            raise ValueError(f"Invalid container_type: {container_type}")
+        # Dict based lookup, raises a ValueError for an invalid container_type
+        container: ContainerBase = self.blobStorageStructure.get_container(container_type)
 
         if not container:
             # Should not happen
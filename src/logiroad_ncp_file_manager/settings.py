@@ -1,7 +1,9 @@
 import os
+from types import MappingProxyType
 from dotenv import load_dotenv
-load_dotenv()
-print("version is 0.1.3")
+# Processes that already get their configuration from the environment can skip the .env file lookup
+if os.getenv("LOGIROAD_SKIP_DOTENV") != "1":
+    load_dotenv()
 default_blob_storage_structure_template_path = "blob_storage_structure_template.json"
 
 AZURE_ACCOUNT_NAME=os.getenv("AZURE_ACCOUNT_NAME")
@@ -10,9 +12,11 @@ AZURE_STORAGE_CONNECTION_STRING=os.getenv("AZURE_STORAGE_CONNECTION_STRING")
 AZURE_CONTAINER_RAW=os.getenv("AZURE_CONTAINER_RAW")
 AZURE_CONTAINER_EXTRACTED=os.getenv("AZURE_CONTAINER_EXTRACTED")
 AZURE_CONTAINER_PROCESSED=os.getenv("AZURE_CONTAINER_PROCESSED")
+AZURE_MAX_PARALLEL_DOWNLOADS=int(os.getenv("AZURE_MAX_PARALLEL_DOWNLOADS", 64))
 
-AZURE_CONTAINERS={
+# Read-only: the container names are read once at import, and cached templates rely on them not changing
+AZURE_CONTAINERS=MappingProxyType({
     'raw': AZURE_CONTAINER_RAW,
     'extracted': AZURE_CONTAINER_EXTRACTED,
     'processed': AZURE_CONTAINER_PROCESSED
-}
\ No newline at end of file
+})
\ No newline at end of file